@@ -0,0 +1,171 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+from cashflow_cal import generate_cashflows
+from interest_curve_cal import build_monthly_df
+from tools import read_config, config_hash
+
+"""
+期间变动归因：比较两次运行（评估日、持仓文件、利率曲线均可不同）的pv,pv_down,pv_up，
+把期初到期末的变动拆分为瀑布图各项，一次完成债券和账户两个层面的归因，不需要用混合输入多次重跑
+参数：
+1.config_0, config_1：期初、期末的配置字典（read_config读取），主流程的file_path/start_date/curve_path/stress_data
+2.cache_dir：运行状态缓存目录，每次运行的现金流矩阵和折现因子按配置哈希及文件修改时间缓存，重复归因直接读取
+返回：
+1.bond_df：债券层面（account_1,account_2,bond_code）瀑布表
+2.account_df：账户层面（account_1,account_2）瀑布表
+瀑布各项（每个measure一行：pv,pv_down,pv_up及利率下降/上升情景相对pv的变动）：
+    期初        = CF0 @ DF0
+    现金流流出  = -(期初至期末评估月之间支付的CF0) @ DF0（含到期）
+    时间推移    = 剩余CF0按期初曲线平移到期末评估日的价值 - 剩余CF0 @ DF0
+    持仓变动    = 存续持仓：CF1 @ DF0' - 剩余CF0 @ DF0'；卖出持仓：-剩余CF0 @ DF0'（DF0'为期初曲线平移到期末）
+    曲线变动    = 存续持仓：CF1 @ DF1 - CF1 @ DF0'
+    新增持仓    = 新增持仓：CF1 @ DF1
+    期末        = CF1 @ DF1
+各项相加严格等于期末-期初；所有乘积由期初、期末两次矩阵乘法得到
+"""
+
+KEY_COLS = ['account_1', 'account_2', 'bond_code']
+META_COLS = ['account_1', 'account_2', 'product_type', 'bond_code', 'bond_name']
+SCENARIO_COLS = ['pv', 'pv_down', 'pv_up']
+WATERFALL_COLS = ['期初', '现金流流出', '时间推移', '持仓变动', '曲线变动', '新增持仓', '期末']
+
+def load_run_state(config, cache_dir='run_cache'):
+    """
+    读取一次运行的现金流矩阵和折现因子，优先使用缓存
+
+    返回:
+    1.state: 字典，start_date、columns（601个YYYYMM列名）、meta（元数据）、cashflows（[债券数, 601]）、
+       discount_factors（[600, 3]，依次为pv,pv_down,pv_up对应的折现因子）
+    """
+    file_path = config.get("file_path")
+    curve_path = config.get("curve_path")
+    mtimes = [os.path.getmtime(path) for path in (file_path, curve_path)]
+    cache_key = config_hash({'config': config, 'mtimes': mtimes})
+    cache_file = os.path.join(cache_dir, f"{cache_key}.npz") if cache_dir else None
+
+    if cache_file and os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            meta = pd.DataFrame({col: cached[f"meta_{col}"] for col in META_COLS})
+            print(f"已读取缓存的运行状态: {config.get('start_date')} ({cache_key})")
+            return {'start_date': str(cached['start_date']), 'columns': list(cached['columns']), 'meta': meta,
+                    'cashflows': cached['cashflows'], 'discount_factors': cached['discount_factors']}
+
+    result_df, principal_result_df, coupon_result_df = generate_cashflows(file_path, config.get("start_date"), months=601)
+    if result_df is None:
+        raise ValueError(f"现金流生成失败: {file_path}")
+    monthly_df = build_monthly_df(curve_path, config.get("stress_data"))
+    if monthly_df is None:
+        raise ValueError(f"折现率曲线生成失败: {curve_path}")
+
+    cashflow_start_col = len(result_df.columns) - 601
+    state = {
+        'start_date': str(config.get("start_date")),
+        'columns': [str(col) for col in result_df.columns[cashflow_start_col:]],
+        'meta': result_df[META_COLS].astype(str).reset_index(drop=True),
+        'cashflows': result_df.iloc[:, cashflow_start_col:].to_numpy(dtype=float),
+        'discount_factors': monthly_df[['rate_discount', 'rate_down_discount', 'rate_up_discount']].to_numpy(dtype=float),
+    }
+    if cache_file:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(cache_file, start_date=state['start_date'], columns=np.array(state['columns']),
+                 cashflows=state['cashflows'], discount_factors=state['discount_factors'],
+                 **{f"meta_{col}": state['meta'][col].to_numpy(dtype=str) for col in META_COLS})
+    return state
+
+def month_offset(state_0, state_1):
+    """期末评估月相对期初评估月的月数"""
+    to_month = lambda label: int(label[:4]) * 12 + int(label[4:6])
+    offset = to_month(state_1['columns'][0]) - to_month(state_0['columns'][0])
+    if not 0 <= offset < 600:
+        raise ValueError(f"期末评估日应晚于期初评估日且相差不超过600个月，实际相差{offset}个月")
+    return offset
+
+def attribute_runs(state_0, state_1):
+    """
+    由两次运行状态计算债券和账户层面的瀑布表
+
+    返回:
+    1.bond_df, account_df: 见模块说明
+    """
+    offset = month_offset(state_0, state_1)
+    discount_0, discount_1 = state_0['discount_factors'], state_1['discount_factors']
+    months = len(discount_0)
+
+    # 期初现金流（第1~600列）一次乘以[流出部分DF0 | 剩余部分DF0 | 剩余部分平移后的DF0']
+    paid = np.arange(months) < offset
+    shifted = np.zeros_like(discount_0)
+    shifted[offset:] = discount_0[:months - offset]
+    factors_0 = np.hstack([discount_0 * paid[:, None], discount_0 * ~paid[:, None], shifted])
+    products_0 = state_0['cashflows'][:, 1:] @ factors_0
+    # 期末现金流一次乘以[DF1 | DF0']
+    products_1 = state_1['cashflows'][:, 1:] @ np.hstack([discount_1, discount_0])
+
+    names_0 = [f"{part}_{col}" for part in ('paid_0', 'remain_0', 'shifted_0') for col in SCENARIO_COLS]
+    names_1 = [f"{part}_{col}" for part in ('curve_1', 'shifted_1') for col in SCENARIO_COLS]
+    run_0 = pd.concat([state_0['meta'], pd.DataFrame(products_0, columns=names_0)], axis=1)
+    run_1 = pd.concat([state_1['meta'], pd.DataFrame(products_1, columns=names_1)], axis=1)
+
+    # 同一账户同一债券多行时合并；名称等取期末（卖出持仓取期初）
+    run_0 = run_0.groupby(KEY_COLS, sort=False).agg({'product_type': 'first', 'bond_name': 'first',
+                                                      **{name: 'sum' for name in names_0}})
+    run_1 = run_1.groupby(KEY_COLS, sort=False).agg({'product_type': 'first', 'bond_name': 'first',
+                                                      **{name: 'sum' for name in names_1}})
+    merged = run_1.join(run_0, how='outer', lsuffix='', rsuffix='_0')
+    held_0 = merged.index.isin(run_0.index)
+    held_1 = merged.index.isin(run_1.index)
+    for col in ('product_type', 'bond_name'):
+        merged[col] = merged[col].fillna(merged[f"{col}_0"])
+    merged = merged.fillna({name: 0.0 for name in names_0 + names_1})
+    status = np.select([held_0 & held_1, held_1], ['存续', '新增'], '卖出或到期')
+
+    frames = []
+    for col in SCENARIO_COLS:
+        paid_0, remain_0, shifted_0 = (merged[f"{part}_{col}"].to_numpy() for part in ('paid_0', 'remain_0', 'shifted_0'))
+        curve_1, shifted_1 = (merged[f"{part}_{col}"].to_numpy() for part in ('curve_1', 'shifted_1'))
+        frames.append(pd.DataFrame({
+            '期初': paid_0 + remain_0,
+            '现金流流出': -paid_0,
+            '时间推移': shifted_0 - remain_0,
+            '持仓变动': np.where(held_0, shifted_1 - shifted_0, 0.0),
+            '曲线变动': np.where(held_0, curve_1 - shifted_1, 0.0),
+            '新增持仓': np.where(held_0, 0.0, curve_1),
+            '期末': curve_1,
+        }, index=merged.index))
+    # 利率下降/上升情景相对基础情景的变动（最低资本口径），由对应情景逐项相减得到
+    frames.append(frames[1] - frames[0])
+    frames.append(frames[2] - frames[0])
+    measures = SCENARIO_COLS + ['pv_down-pv', 'pv_up-pv']
+
+    bond_df = pd.concat([frame.assign(measure=measure) for measure, frame in zip(measures, frames)])
+    bond_df = bond_df.join(merged[['product_type', 'bond_name']]).assign(status=np.tile(status, len(measures)))
+    bond_df = bond_df.reset_index()[KEY_COLS + ['product_type', 'bond_name', 'status', 'measure'] + WATERFALL_COLS]
+    bond_df['measure'] = pd.Categorical(bond_df['measure'], categories=measures, ordered=True)
+    bond_df = bond_df.sort_values(['account_1', 'account_2', 'bond_code', 'measure'], kind='stable').reset_index(drop=True)
+
+    account_df = bond_df.groupby(['account_1', 'account_2', 'measure'], observed=True)[WATERFALL_COLS].sum().reset_index()
+    totals = bond_df.groupby('measure', observed=True)[WATERFALL_COLS].sum().reset_index().assign(account_1='合计', account_2='')
+    account_df = pd.concat([account_df, totals[account_df.columns]], ignore_index=True)
+
+    check = (bond_df[WATERFALL_COLS[:-1]].sum(axis=1) - bond_df['期末']).abs().max()
+    print(f"归因完成：{state_0['start_date']} → {state_1['start_date']}，{len(merged)} 个持仓，"
+          f"瀑布合计与期末差异最大 {check:.2e}")
+    return bond_df, account_df
+
+def attribute_configs(config_0, config_1, cache_dir='run_cache'):
+    """读取（或复用缓存的）两次运行状态并归因"""
+    return attribute_runs(load_run_state(config_0, cache_dir), load_run_state(config_1, cache_dir))
+
+
+if __name__ == "__main__":
+    config_0 = read_config(input("期初参数配置文件:").strip())
+    config_1 = read_config(input("期末参数配置文件:").strip())
+    if not config_0 or not config_1:
+        sys.exit(1)
+    bond_df, account_df = attribute_configs(config_0, config_1)
+    output_file = f"{config_0.get('start_date')}_{config_1.get('start_date')}attribution.xlsx"
+    with pd.ExcelWriter(output_file) as writer:
+        account_df.to_excel(writer, sheet_name='账户汇总', index=False)
+        bond_df.to_excel(writer, sheet_name='债券明细', index=False)
+    print(f"归因结果已保存到: {output_file}")
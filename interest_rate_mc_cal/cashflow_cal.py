@@ -3,28 +3,57 @@ import numpy as np
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import sys
-from tqdm import tqdm
 
 '''
 根据输入的债券基础信息计算现金流
 参数：
-1.file_path：包含债券基础信息的表格，默认直接从持仓明细获得的数据无需处理
+1.file_path：包含债券基础信息的表格，默认直接从持仓明细获得的数据无需处理；也可传入已读取的DataFrame（不修改原表）
     'principal'：本金
     'issue_date'：起息日，一般为YYYY-MM-DD或excel序列值（如44000）
     'maturity_date'：到期日，一般为YYYY-MM-DD或excel序列值（如44000）
     'coupon_rate':百分号前的数据，4
     'payment_freq'：年付/半年付/季付/月付/一次性还本付息/到期支付，通过freq_map自动处理，可修改freq_map增加枚举值
+    'instrument_type'：还本付息方式（可选，默认到期还本），到期还本/等额本金/等额本息/偿债基金，通过instrument_map处理，
+        对应SCHEDULE_KERNELS中的规则；偿债基金的还本计划放在同一文件的'还本计划'sheet或通过schedule参数传入
+        等额本金/等额本息/偿债基金的'principal'为评估时点的持仓剩余本金（与持仓明细一致），按评估月（含）之前
+        已偿还的期数或比例还原发行本金后计算，评估月之后的本金现金流合计等于'principal'；还本计划的比例按发行本金计
     其他字段，例如账户，债券代码等，通过metadata_fields配置，5个字段，如需增加，调整mc_cal的cashflow_start_col参数
 2.start_date：评估日，建议输入YYYYMMDD格式
 3.months：评估时间长度，默认601个月
+4.compact：紧凑模式，默认False，见下方说明
+5.dtype：紧凑模式下现金流的存储精度，默认float32
+6.curve_col：折现曲线映射字段名（如'curve_id'），默认None；设置后该字段作为第6个元数据列输出（文件中无此列时为空，
+  即使用基础曲线），mc_cal.discount_cashflows相应设置cashflow_start_col=6和curve_col进行多曲线折现；
+  curve_col为已有的5个元数据字段之一（如'product_type'）时不再重复输出，cashflow_start_col仍为5
+7.schedule：偿债基金还本计划表（bond_code, redemption_date, redemption_pct），默认None时从file_path的'还本计划'sheet读取
+  （file_path为DataFrame时需通过schedule传入）
 
 返回：
 1.result_df:总现金流
 2.principal_result_df：本金现金流
 3.coupon_result_df：票息现金流
 4.output_file：输出3个sheet的excel表，分别为三个现金流df，默认cashflow_analysis.xlsx
+
+紧凑模式（compact=True）返回一个字典，三张表共用一份元数据，现金流不再复制进DataFrame：
+    'meta'：account_1,account_2,product_type,bond_code,bond_name五列，均为category类型（字典编码）
+    'columns'：601个月份列名（YYYYMM）
+    'result'/'principal'/'coupon'：[债券数, 601]的现金流矩阵，默认float32
+配合mc_cal.discount_compact使用，折现时按行分块转为float64再做矩阵乘法，累加全程为float64。
+误差界：float32存储对每个现金流产生的相对舍入误差不超过2^-24（约6e-8），float64累加误差可忽略，
+因此 |pv_compact - pv| <= 6e-8 × Σ|现金流|×折现因子，现金流非负时pv相对误差不超过6e-8
+（10亿元pv误差不超过60元）。内存和内存带宽约为float64的一半。
 '''
 
+freq_map = {
+    '年付': 1,    # 每年支付1次
+    '半年付': 2,   # 每半年支付1次
+    '季付': 4,     # 每季度支付1次
+    '月付': 12,    # 每月支付1次  
+    '一次性还本付息': 99,  # 到期一次性支付（期末）
+    '到期支付': 98,     # 到期支付
+    # 可根据需要添加更多映射
+}
+
 def parse_date(date_str):
     """
     将日期字符串/Excel 序列值转换为 datetime 对象（支持多种格式）
@@ -73,11 +102,184 @@ def is_same_month(date1, date2):
     """判断两个日期是否在同一个月"""
     return date1.year == date2.year and date1.month == date2.month
 
-def generate_cashflows(file_path, start_date_str, months=360):
+def schedule_month_diff(bonds, date_list):
+    """各计算月与到期月相差的月数[债券数, 月数]（计算月在到期月之后为正），以及到期日有效且非优先股的标记"""
+    col_month = np.array([date.year * 12 + date.month for date in date_list])
+    maturity_date = bonds['maturity_date']
+    valid = maturity_date.notna().to_numpy()
+    maturity_month = np.where(valid, maturity_date.dt.year.fillna(0).to_numpy() * 12 + maturity_date.dt.month.fillna(0).to_numpy(), 0)
+    product_type = bonds['product_type'] if 'product_type' in bonds.columns else pd.Series('', index=bonds.index)
+    active = valid & (product_type != "优先股").to_numpy()
+    return col_month[None, :] - maturity_month[:, None].astype(int), active
+
+def bond_columns(bonds):
+    """还本付息计算用到的字段，均为[债券数, 1]的列向量，便于与[债券数, 月数]矩阵广播"""
+    return (bonds['principal'].to_numpy(dtype=float)[:, None],
+            (bonds['coupon_rate'] / 100).to_numpy(dtype=float)[:, None],
+            bonds['payment_freq'].to_numpy(dtype=float)[:, None],
+            bonds['years_held'].to_numpy(dtype=float)[:, None])
+
+def bullet_schedule(bonds, date_list, schedule=None):
+    """
+    到期还本（原有规则）：到期月还本金；一次性还本付息（99）到期付利息；到期支付（98）只还本金；
+    其余按付息频率从到期月倒推付息月付息；优先股不生成现金流
+
+    返回:
+    1.principal, coupon: [债券数, 月数]的本金和票息现金流
+    """
+    month_diff, active = schedule_month_diff(bonds, date_list)
+    principal, coupon_rate, payment_freq, years_held = bond_columns(bonds)
+    is_maturity_month = active[:, None] & (month_diff == 0)
+    is_regular = active[:, None] & (month_diff <= 0) & ~np.isin(payment_freq, [0, 98, 99])
+
+    principal_flow = np.where(is_maturity_month, principal, 0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        maturity_interest = np.where(is_maturity_month & (payment_freq == 99), principal * coupon_rate * years_held, 0.0)
+        regular_interest = np.where(is_regular & (np.abs(month_diff) % (12 / payment_freq) == 0),
+                                    principal * coupon_rate / payment_freq, 0.0)
+    return principal_flow, maturity_interest + regular_interest
+
+def payment_numbers(bonds, date_list):
+    """
+    分期还本类品种的付息期序号：付息周期为12/payment_freq个月（到期支付类按年），期数按起息日至到期日的月数计算
+
+    返回:
+    1.number: [债券数, 月数]，该月为第几期付款（1~N），非付款月为0
+    2.periods: [债券数, 1]，总期数N
+    3.freq: [债券数, 1]，每年付款次数
+    4.paid: [债券数, 1]，评估月（含）之前已付款的期数
+    """
+    month_diff, active = schedule_month_diff(bonds, date_list)
+    freq = bonds['payment_freq'].to_numpy(dtype=float)
+    freq = np.where(np.isin(freq, [0, 98, 99]), 1, freq)[:, None]
+    period = 12 / freq
+    issue_date = bonds['issue_date']
+    term_months = ((bonds['maturity_date'].dt.year - issue_date.dt.year) * 12
+                   + bonds['maturity_date'].dt.month - issue_date.dt.month).fillna(0).to_numpy(dtype=float)[:, None]
+    periods = np.maximum(np.round(term_months / period), 1)
+    remaining = -month_diff / period
+    number = periods - remaining
+    is_payment = active[:, None] & (month_diff <= 0) & (remaining == np.round(remaining)) & (number >= 1)
+    paid = np.where(active[:, None], np.clip(np.floor(number[:, :1]), 0, periods), 0)
+    return np.where(is_payment, number, 0), periods, freq, paid
+
+def original_principal(principal, outstanding_ratio):
+    """持仓本金为评估时点的剩余本金，按剩余比例还原为发行本金（已全部偿还的不调整）"""
+    return np.where(outstanding_ratio > 0, principal / np.where(outstanding_ratio > 0, outstanding_ratio, 1), principal)
+
+def level_principal_schedule(bonds, date_list, schedule=None):
+    """等额本金：每期偿还发行本金/N，利息按当期期初剩余本金计算"""
+    number, periods, freq, paid = payment_numbers(bonds, date_list)
+    principal, coupon_rate, _, _ = bond_columns(bonds)
+    principal = original_principal(principal, (periods - paid) / periods)
+    is_payment = number > 0
+    outstanding = principal * (periods - number + 1) / periods
+    return (np.where(is_payment, principal / periods, 0.0),
+            np.where(is_payment, outstanding * coupon_rate / freq, 0.0))
+
+def annuity_schedule(bonds, date_list, schedule=None):
+    """等额本息：每期付款额相同，利息按当期期初剩余本金计算，其余为本金"""
+    number, periods, freq, paid = payment_numbers(bonds, date_list)
+    principal, coupon_rate, _, _ = bond_columns(bonds)
+    is_payment = number > 0
+    rate = coupon_rate / freq
+    remaining = periods - number + 1  # 含本期在内的剩余期数
+    with np.errstate(divide='ignore', invalid='ignore'):
+        annuity_factor = np.where(rate > 0, (1 - (1 + rate) ** -periods) / rate, periods)
+        remaining_factor = np.where(rate > 0, (1 - (1 + rate) ** -remaining) / rate, remaining)
+        # 评估时点剩余本金占发行本金的比例 = 剩余期数的年金系数 / 全部期数的年金系数
+        unpaid_factor = np.where(rate > 0, (1 - (1 + rate) ** -(periods - paid)) / rate, periods - paid)
+    principal = original_principal(principal, unpaid_factor / annuity_factor)
+    payment = principal / annuity_factor
+    interest = payment * remaining_factor * rate
+    return np.where(is_payment, payment - interest, 0.0), np.where(is_payment, interest, 0.0)
+
+def sinking_fund_plan(bonds, date_list, schedule):
+    """
+    偿债基金还本计划按债券行展开
+
+    返回:
+    1.rows, column, pct, redemption_date: 每笔提前还本的债券行号、相对评估月的月数、占发行本金的比例、还本日（datetime64[D]）
+    2.scale: [债券数, 1]，持仓剩余本金还原为发行本金的倍数（按评估月（含）之前已偿还的比例）
+    """
+    if schedule is None:
+        raise ValueError("偿债基金类债券需要提供还本计划表（schedule参数或债券文件中的'还本计划'sheet）")
+    num_bonds = len(bonds)
+    plan = pd.DataFrame({'row': np.arange(num_bonds), 'bond_code': bonds['bond_code'].astype(str).to_numpy()})
+    plan = plan.merge(schedule.assign(bond_code=schedule['bond_code'].astype(str)), on='bond_code')
+    redemption_date = pd.to_datetime(plan['redemption_date'].apply(parse_date))
+    column = (redemption_date.dt.year * 12 + redemption_date.dt.month).to_numpy() - (date_list[0].year * 12 + date_list[0].month)
+    pct = plan['redemption_pct'].to_numpy(dtype=float) / 100
+    rows = plan['row'].to_numpy()
+    redeemed = np.bincount(rows[column <= 0], pct[column <= 0], num_bonds)
+    scale = original_principal(np.ones((num_bonds, 1)), 1 - redeemed[:, None])
+    return rows, column, pct, redemption_date.to_numpy(dtype='datetime64[D]'), scale
+
+def sinking_fund_components(bonds, date_list, schedule):
+    """
+    偿债基金现金流的三个部分：到期偿还的剩余本金、按还本计划提前偿还的本金、票息，均为[债券数, 月数]
+    精确日期模式中提前还本按还本计划的实际日期单独生成事件，因此与到期本金分开返回
+    """
+    principal_flow, coupon_flow = bullet_schedule(bonds, date_list)
+    principal, _, _, _ = bond_columns(bonds)
+    num_bonds, months = principal_flow.shape
+    rows, column, pct, _, scale = sinking_fund_plan(bonds, date_list, schedule)
+
+    # 评估月之前已偿还的比例、计算期内各月偿还比例、合计偿还比例
+    redeemed_past = np.bincount(rows[column < 0], pct[column < 0], num_bonds)
+    redemption = np.zeros((num_bonds, months))
+    in_range = (column >= 0) & (column < months)
+    np.add.at(redemption, (rows[in_range], column[in_range]), pct[in_range])
+    redeemed_total = np.bincount(rows, pct, num_bonds)
+    outstanding = 1 - (redeemed_past[:, None] + np.cumsum(redemption, axis=1) - redemption)
+
+    return (principal_flow * scale * (1 - redeemed_total)[:, None],
+            principal * scale * redemption,
+            coupon_flow * outstanding * scale)
+
+def sinking_fund_schedule(bonds, date_list, schedule=None):
+    """
+    偿债基金：按还本计划表（bond_code, redemption_date, redemption_pct：占发行本金的百分比）提前偿还部分本金，
+    到期偿还剩余本金；票息规则同到期还本，按付息月期初的剩余本金计算
+    持仓本金为评估时点的剩余本金，评估月（含）之前的偿还比例用于还原发行本金
+    """
+    maturity_principal, redemption_principal, coupon_flow = sinking_fund_components(bonds, date_list, schedule)
+    return maturity_principal + redemption_principal, coupon_flow
+
+# 还本付息规则注册表：instrument_type → 规则函数，每个函数对一组债券整体计算[债券数, 月数]的本金和票息现金流，
+# 新增品种只需编写函数并在此登记，不增加逐行循环
+SCHEDULE_KERNELS = {
+    'bullet': bullet_schedule,
+    'level_principal': level_principal_schedule,
+    'annuity': annuity_schedule,
+    'sinking_fund': sinking_fund_schedule,
+}
+
+instrument_map = {
+    '': 'bullet',
+    '到期还本': 'bullet',
+    '等额本金': 'level_principal',
+    '等额本息': 'annuity',
+    '偿债基金': 'sinking_fund',
+    # 可根据需要添加更多映射
+}
+
+def instrument_types_of(bond_data):
+    """按instrument_map得到每只债券的还本付息方式（无instrument_type列时均为到期还本），未登记的方式报错"""
+    if 'instrument_type' in bond_data.columns:
+        instrument_types = bond_data['instrument_type'].map(lambda x: instrument_map.get(x, x)).fillna('bullet')
+    else:
+        instrument_types = pd.Series('bullet', index=bond_data.index)
+    unknown_types = sorted(set(instrument_types) - set(SCHEDULE_KERNELS))
+    if unknown_types:
+        raise ValueError(f"未定义还本付息规则的instrument_type: {', '.join(map(str, unknown_types))}")
+    return instrument_types
+
+def generate_cashflows(file_path, start_date_str, months=360, compact=False, dtype=np.float32, curve_col=None, schedule=None):
     """从Excel读取债券数据，生成现金流表（修复数组广播错误）"""
     try:
         # 读取Excel文件
-        bond_data = pd.read_excel(file_path)
+        bond_data = file_path.copy() if isinstance(file_path, pd.DataFrame) else pd.read_excel(file_path)
         
         # 检查必要的列是否存在
         required_columns = ['principal', 'issue_date', 'maturity_date', 'coupon_rate', 'payment_freq']
@@ -86,16 +288,6 @@ def generate_cashflows(file_path, start_date_str, months=360):
         if missing_columns:
             raise ValueError(f"Excel文件缺少必要的列: {', '.join(missing_columns)}")
         
-        freq_map = {
-            '年付': 1,    # 每年支付1次
-            '半年付': 2,   # 每半年支付1次
-            '季付': 4,     # 每季度支付1次
-            '月付': 12,    # 每月支付1次  
-            '一次性还本付息': 99,  # 到期一次性支付（期末）
-            '到期支付': 98,     # 到期支付
-            # 可根据需要添加更多映射
-        }
-        
         # 将付款频率映射为数值
         bond_data['payment_freq'] = bond_data['payment_freq'].map(freq_map).fillna(99)
         
@@ -116,82 +308,38 @@ def generate_cashflows(file_path, start_date_str, months=360):
         
         # 创建结果数组，初始化为0
         num_bonds = len(bond_data)
-        result = np.zeros((num_bonds, months), dtype=float)  # 本金+利息
-        principal_result = np.zeros((num_bonds, months), dtype=float)  # 本金+到期一次还本付息
-        coupon_result = np.zeros((num_bonds, months), dtype=float)  # 票息
-        
-        # 创建日期矩阵（每个债券对应所有计算日期）
-        date_matrix = np.array(date_list, dtype='datetime64[D]')
-        date_matrix = np.tile(date_matrix, (num_bonds, 1))
-        
-        # 创建债券属性矩阵（确保所有矩阵形状一致）
-        principal_matrix = np.tile(bond_data['principal'].values.reshape(-1, 1), (1, months))
-        coupon_rate_matrix = np.tile((bond_data['coupon_rate']/100).values.reshape(-1, 1), (1, months))
-        payment_freq_matrix = np.tile(bond_data['payment_freq'].values.reshape(-1, 1), (1, months))
-        maturity_date_matrix = np.tile(bond_data['maturity_date'].values.reshape(-1, 1), (1, months))
-        maturity_date_end_matrix = np.tile(bond_data['maturity_date_end'].values.reshape(-1, 1), (1, months))
-        years_held_matrix = np.tile(bond_data['years_held'].values.reshape(-1, 1), (1, months))
-        product_type_matrix = np.tile(bond_data.get('product_type', '').values.reshape(-1, 1), (1, months))
-        
-        # 向量化计算月份差异
-        month_diff_matrix = np.zeros((num_bonds, months), dtype=int)
+        storage_dtype = dtype if compact else float
+        result = np.zeros((num_bonds, months), dtype=storage_dtype)  # 本金+利息
+        principal_result = np.zeros((num_bonds, months), dtype=storage_dtype)  # 本金+到期一次还本付息
+        coupon_result = np.zeros((num_bonds, months), dtype=storage_dtype)  # 票息
         
-        # 将NumPy datetime64转换为年、月数组
-        maturity_years = maturity_date_matrix.astype('datetime64[Y]').astype(int) + 1970
-        maturity_months = maturity_date_matrix.astype('datetime64[M]').astype(int) % 12 + 1
-        
-        for i in range(months):
-            current_date = date_list[i]
-            current_year = current_date.year
-            current_month = current_date.month
-            
-            # 计算月份差异
-            month_diff = (current_year - maturity_years[:, i]) * 12 + (current_month - maturity_months[:, i])
-            month_diff_matrix[:, i] = month_diff
-        
-        month_diff_abs_matrix = np.abs(month_diff_matrix)
-        
-        # 向量化计算每个月的现金流
-        for j in tqdm(range(months), desc="计算现金流", unit="月", ncols=80):
-            current_date = date_list[j]
-
-            # 创建掩码矩阵
-            is_maturity_month = np.vectorize(lambda x: is_same_month(current_date, pd.Timestamp(x)))(maturity_date_matrix[:, j])
-            is_before_maturity = date_matrix[:, j] <= maturity_date_end_matrix[:, j]
-            is_not_perpetual = product_type_matrix[:, j] != "优先股"
-            is_freq_98 = payment_freq_matrix[:, j] == 98
-            is_freq_99 = payment_freq_matrix[:, j] == 99
-            freq_not_zero = payment_freq_matrix[:, j] != 0
-
-            # 计算第一部分：基础本金支付（确保freq=98只在到期月支付本金）
-            part1_mask = is_not_perpetual & ((is_freq_98 & is_maturity_month) | (~is_freq_98 & is_maturity_month))
-            part1 = np.zeros(num_bonds)
-            part1[part1_mask] = principal_matrix[part1_mask, j]
-
-            # 计算第二部分：到期利息支付（排除freq=98的债券）
-            part2_mask = is_not_perpetual & is_maturity_month & is_freq_99
-            part2 = np.zeros(num_bonds)
-            part2[part2_mask] = principal_matrix[part2_mask, j] * \
-                              coupon_rate_matrix[part2_mask, j] * \
-                              years_held_matrix[part2_mask, j]
-
-            # 计算第三部分：常规利息支付（排除freq=98的债券）
-            valid_regular_interest = is_not_perpetual & is_before_maturity & ~(is_freq_98 | is_freq_99)
-            part3_condition = (month_diff_abs_matrix[:, j] % (12 / payment_freq_matrix[:, j])) == 0
-            part3_mask = valid_regular_interest & freq_not_zero & part3_condition
-
-            part3 = np.zeros(num_bonds)
-            part3[part3_mask] = principal_matrix[part3_mask, j] * \
-                              coupon_rate_matrix[part3_mask, j] / \
-                              payment_freq_matrix[part3_mask, j]
-
-            # 累加三部分现金流
-            result[:, j] =part1 + part2 + part3
-            principal_result[:, j] = part1
-            coupon_result[:, j] = part2 + part3
+        # 按instrument_type分组，每组由对应的还本付息规则整体计算（见SCHEDULE_KERNELS）
+        instrument_types = instrument_types_of(bond_data)
+        if schedule is None and not isinstance(file_path, pd.DataFrame) and (instrument_types == 'sinking_fund').any():
+            schedule = pd.read_excel(file_path, sheet_name='还本计划')
+
+        for instrument_type in pd.unique(instrument_types):
+            rows = np.flatnonzero((instrument_types == instrument_type).to_numpy())
+            principal_part, coupon_part = SCHEDULE_KERNELS[instrument_type](bond_data.iloc[rows], date_list, schedule)
+            result[rows] = principal_part + coupon_part
+            principal_result[rows] = principal_part
+            coupon_result[rows] = coupon_part
         
-        # 转换为DataFrame
         columns = [date.strftime('%Y%m') for date in date_list]
+        # 曲线映射字段为已有元数据字段时不重复添加
+        extra_fields = [curve_col] if curve_col and curve_col not in ['account_1', 'account_2', 'product_type', 'bond_code', 'bond_name'] else []
+
+        if compact:
+            # 紧凑模式：三张表共用一份字典编码的元数据
+            meta = pd.DataFrame({
+                field_name: (bond_data[field_name] if field_name in bond_data.columns
+                             else pd.Series('', index=bond_data.index)).astype('category')
+                for field_name in ['account_1', 'account_2', 'product_type', 'bond_code', 'bond_name'] + extra_fields
+            }).reset_index(drop=True)
+            return {'meta': meta, 'columns': columns, 'result': result,
+                    'principal': principal_result, 'coupon': coupon_result}
+
+        # 转换为DataFrame
         result_df = pd.DataFrame(result, columns=columns)
         principal_result_df = pd.DataFrame(principal_result, columns=columns)
         coupon_result_df = pd.DataFrame(coupon_result, columns=columns)
@@ -204,6 +352,8 @@ def generate_cashflows(file_path, start_date_str, months=360):
             ('bond_code', lambda: bond_data['bond_code'] if 'bond_code' in bond_data.columns else ''),
             ('bond_name', lambda: bond_data['bond_name'] if 'bond_name' in bond_data.columns else '')
         ]
+        if extra_fields:
+            metadata_fields.append((curve_col, lambda: bond_data[curve_col].fillna('') if curve_col in bond_data.columns else ''))
         
         for df in [result_df, principal_result_df, coupon_result_df]:
             for idx, (field_name, value_getter) in enumerate(metadata_fields):
@@ -213,7 +363,112 @@ def generate_cashflows(file_path, start_date_str, months=360):
     
     except Exception as e:
         print(f"处理Excel文件时出错: {str(e)}")
-        return None, None, None
+        return None if compact else (None, None, None)
+
+def generate_cashflow_events(file_path, start_date_str, months=600, schedule=None):
+    """
+    精确日期模式：按实际支付日生成现金流事件列表，不再归并到月末列
+
+    参数:
+    1.file_path: 债券基础信息表，字段同generate_cashflows
+    2.start_date_str: 评估日
+    3.months: 评估期限（月），支付日晚于评估日且不晚于评估日后第months个月的月末
+    4.schedule: 偿债基金还本计划表，同generate_cashflows
+
+    返回:
+    1.events: DataFrame，每行一笔支付：bond_index（债券行号）、pay_date（datetime64[D]）、principal、coupon、amount，
+       按bond_index、pay_date排序
+    2.meta: 元数据（account_1,account_2,product_type,bond_code,bond_name），行号与bond_index对应
+
+    说明：付息规则与generate_cashflows相同（到期月还本，一次性还本付息到期付息，其余按付息频率从到期月倒推付息月，
+    优先股不生成现金流），付息日取到期日的日，超过当月天数时取月末。评估月内晚于评估日的支付也计入，
+    按月模式中这部分落在第0列、不参与折现。
+    到期还本以外的品种（instrument_type）由SCHEDULE_KERNELS按月计算金额，支付日同样取各支付月中到期日的日；
+    偿债基金的提前还本取还本计划中的redemption_date。
+    """
+    bond_data = pd.read_excel(file_path)
+    missing_columns = [col for col in ['principal', 'issue_date', 'maturity_date', 'coupon_rate', 'payment_freq']
+                       if col not in bond_data.columns]
+    if missing_columns:
+        raise ValueError(f"Excel文件缺少必要的列: {', '.join(missing_columns)}")
+    instrument_types = instrument_types_of(bond_data)
+    is_bullet = (instrument_types == 'bullet').to_numpy()
+
+    freq = bond_data['payment_freq'].map(freq_map).fillna(99).to_numpy(dtype=float)
+    issue_date = pd.to_datetime(bond_data['issue_date'].apply(parse_date)).to_numpy(dtype='datetime64[D]')
+    maturity_date = pd.to_datetime(bond_data['maturity_date'].apply(parse_date)).to_numpy(dtype='datetime64[D]')
+    principal = bond_data['principal'].to_numpy(dtype=float)
+    coupon_rate = bond_data['coupon_rate'].to_numpy(dtype=float) / 100
+    years_held = (maturity_date - issue_date).astype(float) / 365
+    product_type = bond_data['product_type'] if 'product_type' in bond_data.columns else pd.Series('', index=bond_data.index)
+    active = (product_type != "优先股").to_numpy() & ~np.isnat(maturity_date)
+
+    start_date = np.datetime64(parse_date(start_date_str).date(), 'D')
+    end_date = np.datetime64(get_last_day_of_month(parse_date(start_date_str) + relativedelta(months=months)).date(), 'D')
+    maturity_month = maturity_date.astype('datetime64[M]')
+    maturity_day = (maturity_date - maturity_month.astype('datetime64[D]')).astype(int)
+
+    # 到期：本金及一次性还本付息的利息
+    rows = np.flatnonzero(active & is_bullet)
+    maturity_coupon = np.where(freq[rows] == 99, principal[rows] * coupon_rate[rows] * years_held[rows], 0.0)
+    maturity_events = (rows, maturity_date[rows], principal[rows], maturity_coupon)
+
+    # 常规付息：从到期月起每隔12/freq个月倒推，直到早于评估月
+    regular = rows[(freq[rows] != 0) & (freq[rows] != 98) & (freq[rows] != 99)]
+    period = np.rint(12 / freq[regular]).astype(int)
+    months_left = (maturity_month[regular] - start_date.astype('datetime64[M]')).astype(int)
+    counts = np.maximum(months_left // period + 1, 0)
+    bond_index = np.repeat(regular, counts)
+    step = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pay_month = maturity_month[bond_index] - step * np.repeat(period, counts)
+    month_end = (pay_month + 1).astype('datetime64[D]') - 1
+    pay_date = np.minimum(pay_month.astype('datetime64[D]') + maturity_day[bond_index], month_end)
+    coupon_events = (bond_index, pay_date, np.zeros(len(bond_index)),
+                     principal[bond_index] * coupon_rate[bond_index] / freq[bond_index])
+
+    # 其他还本付息方式：与generate_cashflows使用同一规则函数，按月金额落到支付月中到期日的日
+    kernel_events = []
+    if not is_bullet.all():
+        if schedule is None and (instrument_types == 'sinking_fund').any():
+            schedule = pd.read_excel(file_path, sheet_name='还本计划')
+        bonds = bond_data.assign(payment_freq=freq, issue_date=pd.to_datetime(issue_date), maturity_date=pd.to_datetime(maturity_date),
+                                 years_held=years_held)
+        date_list = [get_last_day_of_month(parse_date(start_date_str) + relativedelta(months=i)) for i in range(months + 1)]
+        for instrument_type in pd.unique(instrument_types[~is_bullet]):
+            rows = np.flatnonzero((instrument_types == instrument_type).to_numpy())
+            if instrument_type == 'sinking_fund':
+                # 提前还本取还本计划中的实际日期，评估月（含）之前的已计入持仓剩余本金，不再生成
+                principal_part, _, coupon_part = sinking_fund_components(bonds.iloc[rows], date_list, schedule)
+                plan_rows, column, pct, redemption_date, scale = sinking_fund_plan(bonds.iloc[rows], date_list, schedule)
+                later = column > 0
+                plan_rows = plan_rows[later]
+                kernel_events.append((rows[plan_rows], redemption_date[later],
+                                      principal[rows[plan_rows]] * scale[plan_rows, 0] * pct[later], np.zeros(len(plan_rows))))
+            else:
+                principal_part, coupon_part = SCHEDULE_KERNELS[instrument_type](bonds.iloc[rows], date_list, schedule)
+            row, col = np.nonzero((principal_part != 0) | (coupon_part != 0))
+            pay_month = start_date.astype('datetime64[M]') + col
+            month_end = (pay_month + 1).astype('datetime64[D]') - 1
+            pay_date = np.minimum(pay_month.astype('datetime64[D]') + maturity_day[rows[row]], month_end)
+            kernel_events.append((rows[row], pay_date, principal_part[row, col], coupon_part[row, col]))
+
+    all_events = [maturity_events, coupon_events] + kernel_events
+    events = pd.DataFrame({
+        'bond_index': np.concatenate([item[0] for item in all_events]),
+        'pay_date': np.concatenate([item[1] for item in all_events]),
+        'principal': np.concatenate([item[2] for item in all_events]),
+        'coupon': np.concatenate([item[3] for item in all_events]),
+    })
+    events = events[(events['pay_date'] > start_date) & (events['pay_date'] <= end_date)]
+    # 到期日同时付本金和最后一期利息，合并为一笔
+    events = events.groupby(['bond_index', 'pay_date'], as_index=False)[['principal', 'coupon']].sum()
+    events['amount'] = events['principal'] + events['coupon']
+
+    meta = pd.DataFrame({
+        field_name: bond_data[field_name] if field_name in bond_data.columns else ''
+        for field_name in ['account_1', 'account_2', 'product_type', 'bond_code', 'bond_name']
+    })
+    return events, meta
 
 def main():
     print("===== 债券现金流计算器（向量化计算） =====")
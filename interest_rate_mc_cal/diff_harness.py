@@ -0,0 +1,323 @@
+import os
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+import reference_impl
+import cashflow_cal
+import interest_curve_cal
+import mc_cal
+
+"""
+差异比对工具：在随机生成的合成持仓上，把冻结的参考实现（reference_impl）与待上线的优化实现逐阶段对比，
+证明优化实现与当前生产数字一致后再切换
+比对阶段（候选实现的函数签名须与参考实现一致）：
+1.generate_cashflows：总现金流、本金、利息三张表逐券逐月比对，元数据列要求完全一致
+2.interpolate_rate_curve：rate_1~rate_4及压力情景各列逐期限比对
+3.annual_to_monthly：月度利率和折现因子逐月比对
+4.discount_cashflows：pv,pv_down,pv_up逐券比对（两边使用相同的参考现金流和折现率曲线，只比较本阶段）
+合成持仓覆盖的边界情况：优先股、freq 98/99及无法识别的付息方式、评估月内到期（含评估日前后）、
+已到期、超出评估期限、月末/29~31日到期，日期混用Excel序列值、YYYYMMDD、YYYY-MM-DD字符串和日期类型
+返回：
+1.summary：每次试验×阶段×比对项的最大绝对/相对差异、超出容差的数量、参考与候选耗时及加速比
+2.details：超出容差的明细（债券序号、bond_code、列、参考值、候选值、差异），每项最多保留max_details条
+"""
+
+STAGES = ['generate_cashflows', 'interpolate_rate_curve', 'annual_to_monthly', 'discount_cashflows']
+
+# 各阶段容差：|候选 - 参考| <= atol + rtol × |参考|
+TOLERANCES = {
+    'generate_cashflows': {'rtol': 1e-12, 'atol': 1e-6},
+    'interpolate_rate_curve': {'rtol': 1e-12, 'atol': 1e-9},
+    'annual_to_monthly': {'rtol': 1e-10, 'atol': 1e-12},
+    'discount_cashflows': {'rtol': 1e-10, 'atol': 1e-4},
+}
+
+FREQ_CHOICES = ['年付', '半年付', '季付', '月付', '一次性还本付息', '到期支付', '按需支付']
+PRODUCT_CHOICES = ['国债', '地方政府债券', '企业中期票据', '公司债', '银行次级债', '优先股']
+STRESS_DATA = {
+    '期限': [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 40, 41, 42, 43, 44, 45, 46, 47, 48, 49, 50],
+    '利率向上压力参数': [97, 76, 68, 65, 66, 61, 55, 53, 52, 50, 49, 47, 45, 42, 41, 39, 38, 38, 38, 37, 17, 17, 17, 17, 17, 17, 17, 17, 17, 17, 17],
+    '利率向下压力参数': [-71, -66, -61, -54, -48, -45, -42, -39, -36, -34, -32, -30, -28, -27, -25, -24, -23, -23, -23, -23, -11, -11, -11, -11, -11, -11, -11, -11, -11, -11, -11]
+}
+
+def current_candidates():
+    """当前生产代码中的各阶段实现"""
+    return {
+        'generate_cashflows': cashflow_cal.generate_cashflows,
+        'interpolate_rate_curve': interest_curve_cal.interpolate_rate_curve,
+        'annual_to_monthly': interest_curve_cal.annual_to_monthly,
+        'discount_cashflows': mc_cal.discount_cashflows,
+    }
+
+def compact_generate_cashflows(file_path, start_date_str, months=360):
+    """把紧凑模式（float32）的结果还原为三张表，用于和参考实现比对，容差应放宽到float32精度（rtol约6e-8）"""
+    compact = cashflow_cal.generate_cashflows(file_path, start_date_str, months=months, compact=True)
+    if compact is None:
+        return None, None, None
+    meta = compact['meta'].astype(object)
+    frames = []
+    for key in ['result', 'principal', 'coupon']:
+        frames.append(pd.concat([meta, pd.DataFrame(compact[key].astype(float), columns=compact['columns'])], axis=1))
+    return tuple(frames)
+
+def to_excel_date(date, style):
+    """按指定形式输出日期：excel序列值、YYYYMMDD、YYYY-MM-DD字符串或日期"""
+    if style == 'serial':
+        return int((date - pd.Timestamp('1899-12-30')).days)
+    if style == 'compact':
+        return date.strftime('%Y%m%d')
+    if style == 'dash':
+        return date.strftime('%Y-%m-%d')
+    return date
+
+def make_synthetic_bonds(n_bonds, start_date_str, seed=0):
+    """生成覆盖边界情况的合成持仓"""
+    rng = np.random.default_rng(seed)
+    start_date = pd.Timestamp(cashflow_cal.parse_date(start_date_str))
+    month_start = start_date.replace(day=1)
+    month_end = pd.Timestamp(cashflow_cal.get_last_day_of_month(start_date))
+
+    rows = []
+    for i in range(n_bonds):
+        case = rng.choice(['normal', 'valuation_month', 'matured', 'long', 'month_end'], p=[0.6, 0.15, 0.05, 0.1, 0.1])
+        if case == 'valuation_month':
+            # 评估月内到期，可能在评估日之前或之后
+            maturity = month_start + pd.Timedelta(days=int(rng.integers(0, (month_end - month_start).days + 1)))
+        elif case == 'matured':
+            maturity = start_date - pd.Timedelta(days=int(rng.integers(1, 400)))
+        elif case == 'long':
+            # 超出601个月评估期限
+            maturity = start_date + pd.Timedelta(days=int(rng.integers(45 * 365, 70 * 365)))
+        elif case == 'month_end':
+            maturity = pd.Timestamp(cashflow_cal.get_last_day_of_month(start_date + relativedelta(months=int(rng.integers(1, 360)))))
+            maturity = maturity - pd.Timedelta(days=int(rng.integers(0, 3)))
+        else:
+            maturity = start_date + pd.Timedelta(days=int(rng.integers(1, 30 * 365)))
+        issue = maturity - relativedelta(years=int(rng.integers(1, 31)))
+        issue = pd.Timestamp(issue) - pd.Timedelta(days=int(rng.integers(0, 5)))
+
+        rows.append({
+            'account_1': rng.choice(['传统险', '分红险', '万能险']),
+            'account_2': rng.choice(['寿自营', '委外A', '委外B']),
+            'product_type': rng.choice(PRODUCT_CHOICES, p=[0.15, 0.25, 0.2, 0.2, 0.1, 0.1]),
+            'bond_code': f"SYN{i:06d}",
+            'bond_name': f"合成债券{i}",
+            'principal': float(rng.choice([1e6, 5e6, 1e7, 3e7])) * float(rng.integers(1, 10)) + float(rng.integers(0, 2)) * 0.01,
+            'issue_date': to_excel_date(issue, rng.choice(['serial', 'compact', 'dash', 'date'])),
+            'maturity_date': to_excel_date(maturity, rng.choice(['serial', 'compact', 'dash', 'date'])),
+            'coupon_rate': round(float(rng.uniform(0, 6)), 4),
+            'payment_freq': rng.choice(FREQ_CHOICES, p=[0.3, 0.3, 0.1, 0.05, 0.1, 0.1, 0.05]),
+        })
+    return pd.DataFrame(rows)
+
+def make_synthetic_curve(seed=0):
+    """生成合成基础利率曲线（1~50年整数期限）及插值后的压力参数，格式同apply_stress_to_curve的输出"""
+    rng = np.random.default_rng(seed)
+    terms = np.arange(1, 51)
+    rates = 1.2 + 1.8 * (1 - np.exp(-terms / 8)) + np.cumsum(rng.normal(0, 0.02, len(terms)))
+    rate_curve_df = pd.DataFrame({'date': terms, 'rate': rates})
+    combined_df = interest_curve_cal.interpolate_stress_params(pd.DataFrame(STRESS_DATA))
+    rate_curve_df = interest_curve_cal.apply_stress_to_curve(rate_curve_df, combined_df)
+    return rate_curve_df, combined_df
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    output = func(*args, **kwargs)
+    return output, time.perf_counter() - start
+
+def compare_matrix(stage, item, reference, candidate, row_labels, col_labels, tolerance, max_details):
+    """逐元素比较两个数值矩阵，返回汇总行和超出容差的明细"""
+    reference = np.asarray(reference, dtype=float)
+    candidate = np.asarray(candidate, dtype=float)
+    if reference.shape != candidate.shape:
+        summary = {'stage': stage, 'item': item, 'max_abs_diff': np.inf, 'max_rel_diff': np.inf,
+                   'breaches': -1, 'note': f"形状不一致: {reference.shape} vs {candidate.shape}"}
+        return summary, []
+
+    abs_diff = np.abs(candidate - reference)
+    # 两边同为NaN视为一致
+    both_nan = np.isnan(candidate) & np.isnan(reference)
+    abs_diff = np.where(both_nan, 0.0, abs_diff)
+    abs_diff = np.where(np.isnan(abs_diff), np.inf, abs_diff)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rel_diff = np.where(np.abs(reference) > 0, abs_diff / np.abs(reference), np.where(abs_diff > 0, np.inf, 0.0))
+    breach = abs_diff > tolerance['atol'] + tolerance['rtol'] * np.abs(np.nan_to_num(reference))
+
+    details = []
+    for row, col in zip(*np.nonzero(breach)):
+        if len(details) >= max_details:
+            break
+        details.append({'stage': stage, 'item': item, 'row': int(row), 'label': row_labels[row],
+                        'column': col_labels[col], 'reference': reference[row, col],
+                        'candidate': candidate[row, col], 'abs_diff': abs_diff[row, col]})
+
+    summary = {'stage': stage, 'item': item,
+               'max_abs_diff': float(abs_diff.max()) if abs_diff.size else 0.0,
+               'max_rel_diff': float(rel_diff.max()) if rel_diff.size else 0.0,
+               'breaches': int(breach.sum()), 'note': ''}
+    return summary, details
+
+def compare_metadata(stage, item, reference, candidate):
+    """元数据列要求完全一致"""
+    reference = reference.astype(str).reset_index(drop=True)
+    candidate = candidate.astype(str).reset_index(drop=True)
+    if reference.shape != candidate.shape or list(reference.columns) != list(candidate.columns):
+        mismatches = -1
+    else:
+        mismatches = int((reference.values != candidate.values).sum())
+    return {'stage': stage, 'item': item, 'max_abs_diff': np.nan, 'max_rel_diff': np.nan,
+            'breaches': mismatches, 'note': '元数据'}
+
+def compare_cashflows(reference, candidate, tolerance, max_details, months):
+    summaries, details = [], []
+    if candidate is None or candidate[0] is None:
+        return [{'stage': 'generate_cashflows', 'item': '全部', 'max_abs_diff': np.inf, 'max_rel_diff': np.inf,
+                 'breaches': -1, 'note': '候选实现返回空值'}], []
+    for item, ref_df, cand_df in zip(['总现金流', '本金', '利息'], reference, candidate):
+        meta_count = ref_df.shape[1] - months
+        summaries.append(compare_metadata('generate_cashflows', item + '-元数据',
+                                          ref_df.iloc[:, :meta_count], cand_df.iloc[:, :cand_df.shape[1] - months]))
+        summary, detail = compare_matrix('generate_cashflows', item,
+                                         ref_df.iloc[:, meta_count:].to_numpy(dtype=float),
+                                         cand_df.iloc[:, cand_df.shape[1] - months:].to_numpy(dtype=float),
+                                         ref_df['bond_code'].astype(str).tolist(), list(ref_df.columns[meta_count:]),
+                                         tolerance, max_details)
+        summaries.append(summary)
+        details += detail
+    return summaries, details
+
+def compare_columns(stage, reference, candidate, columns, row_labels, tolerance, max_details):
+    missing = [col for col in columns if col not in candidate.columns]
+    if missing:
+        return [{'stage': stage, 'item': '全部', 'max_abs_diff': np.inf, 'max_rel_diff': np.inf,
+                 'breaches': -1, 'note': f"候选结果缺少列: {', '.join(missing)}"}], []
+    summary, details = compare_matrix(stage, '全部列', reference[columns].to_numpy(dtype=float),
+                                      candidate[columns].to_numpy(dtype=float), row_labels, columns,
+                                      tolerance, max_details)
+    return [summary], details
+
+def run_trial(candidates, n_bonds, start_date_str, seed, tolerances, max_details, months, work_dir):
+    """一次试验：生成合成持仓和曲线，逐阶段运行参考与候选实现并比对"""
+    bonds = make_synthetic_bonds(n_bonds, start_date_str, seed)
+    bond_path = os.path.join(work_dir, f'synthetic_{seed}.xlsx')
+    bonds.to_excel(bond_path, index=False)
+    rate_curve_df, combined_df = make_synthetic_curve(seed)
+
+    summaries, details = [], []
+
+    def record(stage, stage_summaries, stage_details, ref_seconds, cand_seconds):
+        for summary in stage_summaries:
+            summary.update({'seed': seed, 'start_date': start_date_str, 'ref_seconds': ref_seconds,
+                            'cand_seconds': cand_seconds,
+                            'speedup': ref_seconds / cand_seconds if cand_seconds > 0 else np.inf})
+        for detail in stage_details:
+            detail.update({'seed': seed, 'start_date': start_date_str})
+        summaries.extend(stage_summaries)
+        details.extend(stage_details)
+
+    # 1.现金流
+    ref_cashflows, ref_seconds = timed(reference_impl.generate_cashflows, bond_path, start_date_str, months=months)
+    if ref_cashflows[0] is None:
+        raise RuntimeError("参考实现生成现金流失败，请检查合成数据")
+    if 'generate_cashflows' in candidates:
+        cand_cashflows, cand_seconds = timed(candidates['generate_cashflows'], bond_path, start_date_str, months=months)
+        stage_summaries, stage_details = compare_cashflows(ref_cashflows, cand_cashflows,
+                                                           tolerances['generate_cashflows'], max_details, months)
+        record('generate_cashflows', stage_summaries, stage_details, ref_seconds, cand_seconds)
+
+    # 2.曲线插值
+    ref_curve, ref_seconds = timed(reference_impl.interpolate_rate_curve, rate_curve_df.copy(), combined_df)
+    if 'interpolate_rate_curve' in candidates:
+        cand_curve, cand_seconds = timed(candidates['interpolate_rate_curve'], rate_curve_df.copy(), combined_df)
+        columns = [col for col in ref_curve.columns if col != 'date']
+        stage_summaries, stage_details = compare_columns('interpolate_rate_curve', ref_curve, cand_curve, columns,
+                                                         ref_curve['date'].tolist(),
+                                                         tolerances['interpolate_rate_curve'], max_details)
+        record('interpolate_rate_curve', stage_summaries, stage_details, ref_seconds, cand_seconds)
+
+    # 3.月度折现率（两边输入相同的参考插值结果）
+    ref_monthly, ref_seconds = timed(reference_impl.annual_to_monthly, ref_curve.copy())
+    if 'annual_to_monthly' in candidates:
+        cand_monthly, cand_seconds = timed(candidates['annual_to_monthly'], ref_curve.copy())
+        columns = [col for col in ref_monthly.columns if col != 'month']
+        stage_summaries, stage_details = compare_columns('annual_to_monthly', ref_monthly, cand_monthly, columns,
+                                                         ref_monthly['month'].tolist(),
+                                                         tolerances['annual_to_monthly'], max_details)
+        record('annual_to_monthly', stage_summaries, stage_details, ref_seconds, cand_seconds)
+
+    # 4.折现（两边输入相同的参考现金流和折现率）
+    ref_result_df = ref_cashflows[0]
+    cashflow_start_col = ref_result_df.shape[1] - months
+    ref_pv, ref_seconds = timed(reference_impl.discount_cashflows, ref_result_df, ref_monthly, cashflow_start_col)
+    if 'discount_cashflows' in candidates:
+        cand_pv, cand_seconds = timed(candidates['discount_cashflows'], ref_result_df, ref_monthly, cashflow_start_col)
+        stage_summaries, stage_details = compare_columns('discount_cashflows', ref_pv, cand_pv, ['pv', 'pv_down', 'pv_up'],
+                                                         ref_pv['bond_code'].astype(str).tolist(),
+                                                         tolerances['discount_cashflows'], max_details)
+        record('discount_cashflows', stage_summaries, stage_details, ref_seconds, cand_seconds)
+
+    return summaries, details
+
+def run_harness(candidates=None, n_bonds=300, start_dates=('20250430', '20241215'), seeds=(0, 1),
+                tolerances=None, max_details=50, months=601):
+    """
+    运行差异比对
+
+    参数:
+    1.candidates: {阶段名: 候选函数}，None时使用当前生产实现；只传部分阶段时只比对这些阶段
+    2.n_bonds: 每次试验的合成债券数
+    3.start_dates: 评估日列表（建议同时包含月末和月中）
+    4.seeds: 随机种子列表，试验次数 = len(start_dates) × len(seeds)
+    5.tolerances: 覆盖TOLERANCES中的部分阶段容差
+    6.max_details: 每个比对项最多保留的明细条数
+    7.months: 现金流月数，默认601
+
+    返回:
+    1.summary, details：见模块说明
+    """
+    candidates = current_candidates() if candidates is None else candidates
+    unknown = [stage for stage in candidates if stage not in STAGES]
+    if unknown:
+        raise ValueError(f"未知的比对阶段: {', '.join(unknown)}")
+    stage_tolerances = {stage: dict(value) for stage, value in TOLERANCES.items()}
+    for stage, value in (tolerances or {}).items():
+        stage_tolerances[stage].update(value)
+
+    summaries, details = [], []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for start_date_str in start_dates:
+            for seed in seeds:
+                trial_summaries, trial_details = run_trial(candidates, n_bonds, start_date_str, seed,
+                                                           stage_tolerances, max_details, months, work_dir)
+                summaries += trial_summaries
+                details += trial_details
+
+    summary = pd.DataFrame(summaries, columns=['start_date', 'seed', 'stage', 'item', 'max_abs_diff', 'max_rel_diff',
+                                               'breaches', 'ref_seconds', 'cand_seconds', 'speedup', 'note'])
+    details = pd.DataFrame(details, columns=['start_date', 'seed', 'stage', 'item', 'row', 'label', 'column',
+                                             'reference', 'candidate', 'abs_diff'])
+    return summary, details
+
+def print_summary(summary):
+    """按阶段打印比对结论"""
+    print("===== 差异比对结果 =====")
+    for stage, group in summary.groupby('stage', sort=False):
+        passed = (group['breaches'] == 0).all()
+        stage_times = group.drop_duplicates(['start_date', 'seed'])
+        speedup = stage_times['ref_seconds'].sum() / max(stage_times['cand_seconds'].sum(), 1e-12)
+        print(f"{'✅' if passed else '❌'} {stage}: 最大绝对差异 {group['max_abs_diff'].max():.3g}，"
+              f"最大相对差异 {group['max_rel_diff'].max():.3g}，超出容差 {int(group['breaches'].clip(lower=0).sum())} 处，"
+              f"加速比 {speedup:.2f}x")
+
+
+if __name__ == "__main__":
+    n_bonds = input("每次试验的合成债券数 (默认300):").strip()
+    summary, details = run_harness(n_bonds=int(n_bonds) if n_bonds else 300)
+    print_summary(summary)
+    output_file = input("请输入输出Excel文件名 (默认diff_report.xlsx):").strip() or "diff_report.xlsx"
+    with pd.ExcelWriter(output_file, engine='openpyxl') as writer:
+        summary.to_excel(writer, sheet_name='汇总', index=False)
+        details.to_excel(writer, sheet_name='明细', index=False)
+    print(f"比对报告已保存到: {output_file}")
@@ -4,6 +4,7 @@ from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import sys
 from tqdm import tqdm
+from cashflow_cal import parse_date
 
 """
 将输入的现金流根据压力参数进行处理，得到三条折现率曲线
@@ -14,6 +15,9 @@ from tqdm import tqdm
 3.其他插值主要参数: - ultimate_rate: 基础终极利率（%前数字），默认4.5
                     - premium_base_1: 短期（<=20年）基础溢价（%前数字），默认0.45
                     - premium_base_2: 长期（>=41年）基础溢价（%前数字），默认0
+4.外推方法：默认按interpolate_rate_curve线性过渡到终极利率；集团报告口径可用smith_wilson_monthly
+  （build_monthly_df中method="smith_wilson"），以20年及以内期限为流动性期限点做Smith-Wilson外推，
+  核矩阵对同一组期限点只求解一次，各压力情景只需一次矩阵乘法
 返回：
 1.monthly_df：三条折现率曲线
 """
@@ -367,9 +371,175 @@ def annual_to_monthly(rate_curve_df, rate_cols=['rate_4', 'rate_up_4', 'rate_dow
                 monthly_df.loc[monthly_df['month'] == month, discount_factor_col] = cumulative_discount
 
     result_columns += monthly_rate_columns + discount_factor_columns
-    
+
     return monthly_df[result_columns]
 
+def apply_spread_to_monthly(monthly_df, spread_bp):
+    """
+    在月度折现率表的三条曲线上统一加信用利差，生成同格式的新表（用于按产品类型/评级的多曲线折现）
+
+    参数:
+    - monthly_df: annual_to_monthly返回的月度折现率表
+    - spread_bp: 利差（bp），加在各月对应的年化远期利率上
+
+    返回:
+    - 加利差后的月度折现率表
+    """
+    spread_df = monthly_df.copy()
+    for rate_col in [col for col in monthly_df.columns if col.endswith('_monthly')]:
+        discount_factor_col = rate_col.replace('_monthly', '_discount')
+        annual_rate = (1 + monthly_df[rate_col].to_numpy(dtype=float)) ** 12 - 1
+        monthly_rate = (1 + annual_rate + spread_bp / 10000) ** (1/12) - 1
+        spread_df[rate_col] = monthly_rate
+        spread_df[discount_factor_col] = np.cumprod(1 / (1 + monthly_rate))
+    return spread_df
+
+def build_daily_discount_grid(monthly_df, start_date, discount_cols=('rate_discount', 'rate_down_discount', 'rate_up_discount')):
+    """
+    由月度折现率表生成逐日折现因子表（精确日期折现用），只需计算一次
+
+    参数:
+    - monthly_df: annual_to_monthly（或smith_wilson_monthly）返回的月度折现率表，第month行对应评估日后第month个月的月末
+    - start_date: 评估日（datetime或字符串，与generate_cashflow_events相同按cashflow_cal.parse_date解析）
+    - discount_cols: 折现因子列
+
+    返回:
+    - grid: 字典，start_date（datetime64[D]）、discount（[天数+1, 情景数]，第d行为评估日后第d天的折现因子）、columns
+      评估日折现因子为1，各月末取月度表的值，相邻月末之间按天对数线性插值（即月内远期利率不变）
+    """
+    start = pd.Timestamp(parse_date(start_date))
+    month_ends = pd.date_range(start + pd.offsets.MonthEnd(0), periods=len(monthly_df) + 1, freq=pd.offsets.MonthEnd())[1:]
+    anchor_days = np.concatenate([[0], (month_ends - start).days.to_numpy()])
+    days = np.arange(anchor_days[-1] + 1)
+    log_discount = np.log(np.vstack([np.ones(len(discount_cols)), monthly_df[list(discount_cols)].to_numpy(dtype=float)]))
+    discount = np.exp(np.column_stack([np.interp(days, anchor_days, log_discount[:, k]) for k in range(len(discount_cols))]))
+    return {'start_date': np.datetime64(start.date(), 'D'), 'discount': discount, 'columns': list(discount_cols)}
+
+SMITH_WILSON_CACHE = {}
+
+def smith_wilson_matrix(liquid_terms, terms, alpha=0.1):
+    """
+    Smith-Wilson插值矩阵 A = H(t,u)·H(u,u)⁻¹，只与流动性期限点、输出期限和alpha有关，与利率水平和终极利率无关，
+    同一组流动性期限点只求解一次并缓存，各情景曲线复用
+
+    参数:
+    - liquid_terms: 流动性期限点u（年）
+    - terms: 输出期限t（年）
+    - alpha: 收敛速度参数
+
+    返回:
+    - A: 形状[len(terms), len(liquid_terms)]
+    """
+    liquid_terms = np.asarray(liquid_terms, dtype=float)
+    terms = np.asarray(terms, dtype=float)
+    key = (liquid_terms.tobytes(), terms.tobytes(), alpha)
+    if key not in SMITH_WILSON_CACHE:
+        def wilson_h(t, u):
+            low, high = np.minimum(t[:, None], u[None, :]), np.maximum(t[:, None], u[None, :])
+            return alpha * low - 0.5 * np.exp(-alpha * high) * (np.exp(alpha * low) - np.exp(-alpha * low))
+        SMITH_WILSON_CACHE[key] = np.linalg.solve(wilson_h(liquid_terms, liquid_terms), wilson_h(terms, liquid_terms).T).T
+    return SMITH_WILSON_CACHE[key]
+
+def smith_wilson_discount(liquid_terms, liquid_rates, ultimate_rates, terms, alpha=0.1):
+    """
+    批量Smith-Wilson外推：P(t) = e^(-ωt)·(1 + A·(e^(ωu)·p(u) - 1))，ω = ln(1 + UFR)
+
+    参数:
+    - liquid_terms: 流动性期限点u（年）
+    - liquid_rates: 流动性期限点的年复利即期利率（%前数字），形状[len(u), 情景数]，每列一个情景
+    - ultimate_rates: 各情景终极利率（%前数字），形状[情景数]
+    - terms: 输出期限t（年）
+    - alpha: 收敛速度参数
+
+    返回:
+    - 折现因子矩阵，形状[len(terms), 情景数]；新增情景只增加一次矩阵乘法
+    """
+    liquid_terms = np.asarray(liquid_terms, dtype=float)
+    liquid_rates = np.asarray(liquid_rates, dtype=float).reshape(len(liquid_terms), -1)
+    omega = np.log(1 + np.asarray(ultimate_rates, dtype=float).reshape(-1) / 100)
+    terms = np.asarray(terms, dtype=float)
+    liquid_prices = (1 + liquid_rates / 100) ** (-liquid_terms[:, None])
+    scaled_gap = np.exp(omega[None, :] * liquid_terms[:, None]) * liquid_prices - 1
+    return np.exp(-omega[None, :] * terms[:, None]) * (1 + smith_wilson_matrix(liquid_terms, terms, alpha) @ scaled_gap)
+
+def smith_wilson_monthly(rate_curve_df, stress_param_df, ultimate_rate=4.5, premium_base_1=0.45, premium_base_2=0,
+                         alpha=0.1, last_liquid_point=20, max_years=50, extra_scenarios=None):
+    """
+    用Smith-Wilson方法代替interpolate_rate_curve的线性过渡外推，直接生成与annual_to_monthly格式相同的月度折现率表
+
+    参数:
+    - rate_curve_df: apply_stress_to_curve返回的DataFrame（包含rate、rate_up、rate_down列）
+    - stress_param_df: 压力参数表，终极利率按40年压力参数调整（与interpolate_rate_curve一致）
+    - ultimate_rate: 基础终极利率（%前数字），实际使用的终极利率为调整后终极利率+premium_base_2
+    - premium_base_1: 流动性期限点上加的基础溢价（%前数字）
+    - premium_base_2: 长期基础溢价（%前数字）
+    - alpha: 收敛速度参数，默认0.1
+    - last_liquid_point: 最后流动性期限点（年），默认20，该期限及以内的整数年期限作为流动性期限点
+    - max_years: 输出年数（默认50年=600个月）
+    - extra_scenarios: 额外情景，{名称: (rate_curve_df中的利率列名, 终极利率)}，输出列为名称_monthly、名称_discount
+
+    返回:
+    - monthly_df：month、各情景_monthly（月度远期利率）、各情景_discount（累积折现因子）
+    """
+    up_param_map = dict(zip(stress_param_df['期限'], stress_param_df['利率向上压力参数']))
+    down_param_map = dict(zip(stress_param_df['期限'], stress_param_df['利率向下压力参数']))
+    scenarios = {
+        'rate': ('rate', ultimate_rate),
+        'rate_up': ('rate_up', ultimate_rate * (1 + up_param_map.get(40, 0))),
+        'rate_down': ('rate_down', ultimate_rate * (1 + down_param_map.get(40, 0))),
+    }
+    scenarios.update(extra_scenarios or {})
+
+    liquid_df = rate_curve_df[rate_curve_df['date'] <= last_liquid_point].sort_values('date')
+    liquid_terms = liquid_df['date'].to_numpy(dtype=float)
+    liquid_rates = np.column_stack([liquid_df[col].to_numpy(dtype=float) for col, _ in scenarios.values()]) + premium_base_1
+    ultimate_rates = np.array([ufr for _, ufr in scenarios.values()]) + premium_base_2
+
+    months = np.arange(1, max_years * 12 + 1)
+    discount_factors = smith_wilson_discount(liquid_terms, liquid_rates, ultimate_rates, months / 12, alpha)
+    previous = np.vstack([np.ones((1, discount_factors.shape[1])), discount_factors[:-1]])
+
+    monthly_df = pd.DataFrame({'month': months})
+    for k, name in enumerate(scenarios):
+        monthly_df[f"{name}_monthly"] = previous[:, k] / discount_factors[:, k] - 1
+    for k, name in enumerate(scenarios):
+        monthly_df[f"{name}_discount"] = discount_factors[:, k]
+    return monthly_df
+
+def build_monthly_df(curve_path, stress_data, sheet_name="Export", ultimate_rate=4.5, premium_base_1=0.45, premium_base_2=0,
+                     method="linear", alpha=0.1):
+    """
+    按主流程第2步，由利率曲线文件和压力参数一次性生成monthly_df
+
+    参数:
+    - curve_path: 基础利率曲线Excel文件路径
+    - stress_data: 压力参数字典（即配置文件中的stress_data）
+    - sheet_name: 利率曲线所在sheet
+    - ultimate_rate, premium_base_1, premium_base_2: 同interpolate_rate_curve
+    - method: "linear"为原线性过渡外推，"smith_wilson"为Smith-Wilson外推（见smith_wilson_monthly）
+    - alpha: Smith-Wilson收敛速度参数
+
+    返回:
+    - monthly_df：三条折现率曲线（加载失败时返回None）
+    """
+    param_df = pd.DataFrame(stress_data)
+    rate_curve_df = load_rate_curve(curve_path, sheet_name=sheet_name)
+    if rate_curve_df is None:
+        return None
+    combined_df = interpolate_stress_params(param_df, term_col='期限', up_col='利率向上压力参数',
+                                            down_col='利率向下压力参数', start_term=20, end_term=40)
+    rate_curve_df = apply_stress_to_curve(rate_curve_df, combined_df, base_rate_col='rate',
+                                          term_col='date', up_param_col='利率向上压力参数',
+                                          down_param_col='利率向下压力参数')
+    if method == "smith_wilson":
+        return smith_wilson_monthly(rate_curve_df, combined_df, ultimate_rate=ultimate_rate, premium_base_1=premium_base_1,
+                                    premium_base_2=premium_base_2, alpha=alpha)
+    if method != "linear":
+        raise ValueError(f"不支持的曲线外推方法: {method}")
+    rate_curve_df = interpolate_rate_curve(rate_curve_df, combined_df, ultimate_rate=ultimate_rate,
+                                           premium_base_1=premium_base_1, premium_base_2=premium_base_2)
+    return annual_to_monthly(rate_curve_df, rate_cols=['rate_4', 'rate_up_4', 'rate_down_4'])
+
 if __name__=="__main__":
     data = {
     '期限': [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 40, 41,42,43,44,45,46,47,48,49,50],
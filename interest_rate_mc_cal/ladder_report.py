@@ -0,0 +1,145 @@
+import pandas as pd
+import numpy as np
+import sys
+from cashflow_cal import generate_cashflows
+from interest_curve_cal import build_monthly_df
+from tools import read_config, beautify_excel
+
+"""
+根据cashflow_cal返回的本金、票息现金流生成分桶现金流阶梯表（ALM现金流缺口报表）
+参数：
+1.principal_result_df, coupon_result_df：cashflow_cal返回的本金、票息现金流，默认601个月
+2.monthly_df：interest_curve_cal返回的三条折现率曲线，传入时额外输出pv,pv_down,pv_up三种折现口径
+3.bucket_edges：时间桶边界（年），默认0-1y,1-3y,3-5y,5-10y,10-20y,20-30y,30y+，区间为左开右闭
+4.group_cols：分组字段，默认account_1,account_2,product_type
+返回：
+1.ladder_df：每个分组×现金流类型（本金/利息）×口径（cashflow/pv/pv_down/pv_up）一行，每个时间桶一列
+
+说明：与mc_cal一致，第1列（评估月）不计入阶梯表，第j列对应期限j/12年。
+计算方式：先把各口径的"折现因子×分桶指示"拼成一个600×(口径数×桶数)的权重矩阵，
+本金、利息各做一次矩阵乘法得到每只债券的分桶值，再按分组排序后用np.add.reduceat分段求和，
+不需要导出601列的中间表。
+"""
+
+DEFAULT_BUCKET_EDGES = [0, 1, 3, 5, 10, 20, 30]
+DEFAULT_GROUP_COLS = ['account_1', 'account_2', 'product_type']
+
+def bucket_labels(bucket_edges):
+    """根据桶边界生成桶名称，如 0-1y、30y+"""
+    labels = [f"{lo:g}-{hi:g}y" for lo, hi in zip(bucket_edges[:-1], bucket_edges[1:])]
+    labels.append(f"{bucket_edges[-1]:g}y+")
+    return labels
+
+def build_bucket_matrix(months, bucket_edges):
+    """
+    生成分桶指示矩阵
+    - months: 参与分桶的月数（默认600，对应第2~601列）
+    - 返回形状为[months, 桶数]的0/1矩阵，第j行（期限(j+1)/12年）落在(lo, hi]的桶
+    """
+    terms = np.arange(1, months + 1) / 12
+    bucket_idx = np.searchsorted(np.asarray(bucket_edges[1:], dtype=float), terms, side='left')
+    bucket_matrix = np.zeros((months, len(bucket_edges)), dtype=float)
+    bucket_matrix[np.arange(months), bucket_idx] = 1.0
+    return bucket_matrix
+
+def build_cashflow_ladder(principal_result_df, coupon_result_df, monthly_df=None, bucket_edges=None,
+                          group_cols=None, cashflow_start_col=5):
+    """
+    生成分桶现金流阶梯表
+
+    参数:
+    1.principal_result_df, coupon_result_df: cashflow_cal返回的本金、票息现金流表
+    2.monthly_df: 月度折现率表，None时只输出未折现现金流
+    3.bucket_edges: 时间桶边界（年），默认DEFAULT_BUCKET_EDGES
+    4.group_cols: 分组字段，默认DEFAULT_GROUP_COLS，需为现金流表中的元数据列
+    5.cashflow_start_col: 现金流起始列索引，同mc_cal
+
+    返回:
+    1.ladder_df: 分组字段 + cashflow_type + measure + 各时间桶
+    """
+    bucket_edges = DEFAULT_BUCKET_EDGES if bucket_edges is None else list(bucket_edges)
+    group_cols = DEFAULT_GROUP_COLS if group_cols is None else list(group_cols)
+
+    missing_cols = [col for col in group_cols if col not in principal_result_df.columns]
+    if missing_cols:
+        raise ValueError(f"现金流表缺少分组列: {', '.join(missing_cols)}")
+
+    # 跳过评估月，取第2~601列
+    principal_matrix = principal_result_df.iloc[:, cashflow_start_col + 1:].to_numpy(dtype=float)
+    coupon_matrix = coupon_result_df.iloc[:, cashflow_start_col + 1:].to_numpy(dtype=float)
+    months = principal_matrix.shape[1]
+
+    # 各口径权重：未折现为1，折现口径为对应折现因子
+    measures = ['cashflow']
+    weights = [np.ones(months)]
+    if monthly_df is not None:
+        discount_factors = monthly_df[[
+            'rate_discount',
+            'rate_down_discount',
+            'rate_up_discount'
+        ]].to_numpy(dtype=float)
+        if len(discount_factors) < months:
+            raise ValueError(f"折现因子月数应不少于{months}，但实际为{len(discount_factors)}")
+        measures += ['pv', 'pv_down', 'pv_up']
+        weights += [discount_factors[:months, k] for k in range(3)]
+
+    # 权重矩阵：[months, 口径数×桶数]
+    bucket_matrix = build_bucket_matrix(months, bucket_edges)
+    weight_matrix = np.hstack([bucket_matrix * w[:, None] for w in weights])
+
+    # 每只债券的分桶值：[债券数, 口径数×桶数]
+    bond_principal = principal_matrix @ weight_matrix
+    bond_coupon = coupon_matrix @ weight_matrix
+
+    # 分组分段求和
+    meta = principal_result_df[group_cols].reset_index(drop=True)
+    codes = meta.groupby(group_cols, sort=True, dropna=False).ngroup().to_numpy()
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    group_principal = np.add.reduceat(bond_principal[order], starts, axis=0)
+    group_coupon = np.add.reduceat(bond_coupon[order], starts, axis=0)
+    group_keys = meta.iloc[order[starts]].reset_index(drop=True)
+
+    # 展开为长表：分组 × 现金流类型 × 口径
+    n_groups = len(starts)
+    n_measures = len(measures)
+    n_buckets = len(bucket_edges)
+    labels = bucket_labels(bucket_edges)
+    frames = []
+    for cashflow_type, values in [('本金', group_principal), ('利息', group_coupon)]:
+        values = values.reshape(n_groups * n_measures, n_buckets)
+        frame = group_keys.loc[np.repeat(np.arange(n_groups), n_measures)].reset_index(drop=True)
+        frame['cashflow_type'] = cashflow_type
+        frame['measure'] = np.tile(measures, n_groups)
+        frame = pd.concat([frame, pd.DataFrame(values, columns=labels)], axis=1)
+        frames.append(frame)
+
+    ladder_df = pd.concat(frames, ignore_index=True)
+    # 按分组、本金在前、口径顺序排列
+    type_order = ladder_df['cashflow_type'].map({'本金': 0, '利息': 1})
+    measure_order = ladder_df['measure'].map({measure: k for k, measure in enumerate(measures)})
+    ladder_df = ladder_df.assign(_type_order=type_order, _measure_order=measure_order)
+    ladder_df = ladder_df.sort_values(group_cols + ['_type_order', '_measure_order'], kind='stable')
+    ladder_df = ladder_df.drop(columns=['_type_order', '_measure_order']).reset_index(drop=True)
+    ladder_df['合计'] = ladder_df[labels].sum(axis=1)
+    return ladder_df
+
+
+if __name__ == "__main__":
+    config_path = input("参数配置文件:").strip()
+    config = read_config(config_path)
+    if not config:
+        sys.exit(1)
+    start_date = config.get("start_date")
+    result_df, principal_result_df, coupon_result_df = generate_cashflows(config.get("file_path"), start_date, months=601)
+    if principal_result_df is None:
+        print("生成现金流表失败")
+        sys.exit(1)
+    monthly_df = build_monthly_df(config.get("curve_path"), config.get("stress_data"))
+    ladder_df = build_cashflow_ladder(principal_result_df, coupon_result_df, monthly_df,
+                                      cashflow_start_col=len(principal_result_df.columns) - 601)
+    output_file = start_date + 'ladder.xlsx'
+    ladder_df.to_excel(output_file, index=False)
+    beautify_excel(input_file=output_file, output_file=output_file)
+    print(f"现金流阶梯表已生成并保存到: {output_file}")
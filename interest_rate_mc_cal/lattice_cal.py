@@ -0,0 +1,267 @@
+import pandas as pd
+import numpy as np
+import sys
+from dateutil.relativedelta import relativedelta
+from cashflow_cal import parse_date, get_last_day_of_month, generate_cashflows, freq_map
+from interest_curve_cal import build_monthly_df
+from mc_cal import discount_cashflows
+from tools import read_config
+
+"""
+含权债券（可赎回/可回售）和优先股的树模型估值
+cashflow_cal对优先股现金流全部置零，含权条款也未考虑，本模块用Hull-White三叉树计算期权调整后的pv,pv_down,pv_up
+参数：
+1.file_path：债券基础信息表，在cashflow_cal字段基础上可增加以下含权字段（无此列或为空表示不含权）：
+    'option_type'：赎回/回售（也可写call/put），通过option_map处理
+    'option_date'：首个行权日，此后每个付息月（到期支付类为每年同月）均可行权
+    'option_price'：行权价格，占本金百分比（百分号前的数字），默认100
+    优先股：按票息率和付息频率一直派息至评估期末，期末按面值计终值；未填option_type时视为发行人
+            自maturity_date（首个赎回日）起可按面值赎回
+2.start_date：评估日
+3.monthly_df：interest_curve_cal返回的三条折现率曲线，每条曲线各建一棵树
+4.a, sigma：Hull-White模型均值回复速度和短期利率波动率（绝对值，0.01即100bp），默认0.05和0.01
+返回：
+1.result：与mc_cal.discount_cashflows格式相同，含权债和优先股为期权调整后的值，
+  valuation_method列标明lattice（树模型）或discount（直接折现）
+
+说明：
+1.树按月分步（与601列现金流一致），用Arrow-Debreu价格逐步校准漂移项，使无期权现金流在树上的价值与
+  discount_cashflows完全一致（差异仅为浮点误差）
+2.同一条曲线的树只建一次，所有含权债券作为矩阵的行一起做逆向归纳，每步为[节点数, 债券数]的向量运算，
+  不按债券循环；同一曲线和参数的树在进程内缓存，重复估值和不同批次的债券复用同一棵树
+"""
+
+option_map = {
+    '赎回': 1,
+    '发行人赎回': 1,
+    'call': 1,
+    '回售': -1,
+    '投资人回售': -1,
+    'put': -1,
+    # 可根据需要添加更多映射
+}
+
+LATTICE_CACHE = {}
+
+def build_hw_lattice(discount_factors, a=0.05, sigma=0.01, dt=1/12):
+    """
+    构建并校准Hull-White三叉树
+
+    参数:
+    1.discount_factors: 第1~N期的累积折现因子（monthly_df中某条曲线的_discount列）
+    2.a, sigma: 均值回复速度、短期利率波动率
+    3.dt: 步长（年），默认1个月
+
+    返回:
+    1.lattice: 字典，包含各节点的后继节点、转移概率及每一步各节点的单期折现因子
+    """
+    discount_factors = np.asarray(discount_factors, dtype=float)
+    key = (discount_factors.tobytes(), a, sigma, dt)
+    if key in LATTICE_CACHE:
+        return LATTICE_CACHE[key]
+
+    steps = len(discount_factors)
+    dx = sigma * np.sqrt(3 * dt)
+    M = -a * dt
+    jmax = int(np.ceil(0.184 / (a * dt)))
+    j = np.arange(-jmax, jmax + 1)
+    width = len(j)
+
+    # 普通节点：后继为j+1, j, j-1；顶部节点向下分叉：j, j-1, j-2；底部节点向上分叉：j+2, j+1, j
+    jm2 = (j * M) ** 2
+    pu = 1/6 + (jm2 + j * M) / 2
+    pm = 2/3 - jm2
+    pd_ = 1/6 + (jm2 - j * M) / 2
+    shift = np.zeros(width, dtype=int)
+    top, bottom = width - 1, 0
+    pu[top], pm[top], pd_[top] = 7/6 + (jm2[top] + 3 * j[top] * M) / 2, -1/3 - jm2[top] - 2 * j[top] * M, 1/6 + (jm2[top] + j[top] * M) / 2
+    pu[bottom], pm[bottom], pd_[bottom] = 1/6 + (jm2[bottom] - j[bottom] * M) / 2, -1/3 - jm2[bottom] + 2 * j[bottom] * M, 7/6 + (jm2[bottom] - 3 * j[bottom] * M) / 2
+    shift[top], shift[bottom] = -1, 1
+    index = np.arange(width)
+    succ_u, succ_m, succ_d = index + 1 + shift, index + shift, index - 1 + shift
+
+    # 前向校准：alpha_m使Σ_j Q_{m,j}·exp(-(alpha_m + j·dx)·dt) = P(m+1)
+    q = np.zeros(width)
+    q[jmax] = 1.0
+    step_discount = np.empty((steps, width))
+    for m in range(steps):
+        node_discount = np.exp(-j * dx * dt)
+        alpha = (np.log(np.dot(q, node_discount)) - np.log(discount_factors[m])) / dt
+        step_discount[m] = np.exp(-alpha * dt) * node_discount
+        weighted = q * step_discount[m]
+        q = (np.bincount(succ_u, weighted * pu, width)
+             + np.bincount(succ_m, weighted * pm, width)
+             + np.bincount(succ_d, weighted * pd_, width))
+
+    lattice = {'jmax': jmax, 'steps': steps, 'succ_u': succ_u, 'succ_m': succ_m, 'succ_d': succ_d,
+               'pu': pu, 'pm': pm, 'pd': pd_, 'step_discount': step_discount}
+    LATTICE_CACHE[key] = lattice
+    return lattice
+
+def lattice_price(lattice, cashflow_matrix, exercise_mask=None, strikes=None, option_sign=None):
+    """
+    在树上对一批债券做逆向归纳
+
+    参数:
+    1.lattice: build_hw_lattice的返回值
+    2.cashflow_matrix: [债券数, 步数+1]，第0列为评估月（不计入pv，与discount_cashflows一致）
+    3.exercise_mask: [债券数, 步数+1]布尔矩阵，True表示该月可行权（行权价为除息价）
+    4.strikes: [债券数]行权金额
+    5.option_sign: [债券数]，1为发行人赎回（取min），-1为投资人回售（取max），0为不含权
+
+    返回:
+    1.pv: [债券数]
+    """
+    steps = lattice['steps']
+    cashflow_matrix = np.asarray(cashflow_matrix, dtype=float)
+    if cashflow_matrix.shape[1] != steps + 1:
+        raise ValueError(f"现金流列数量应为{steps + 1}，但实际为{cashflow_matrix.shape[1]}")
+    num_bonds = len(cashflow_matrix)
+    width = len(lattice['pu'])
+    # 按[节点数, 债券数]存放，每个节点的全部债券在内存中连续，切片运算比按债券存放快
+    cashflow_by_month = np.ascontiguousarray(cashflow_matrix.T)
+    has_option = exercise_mask is not None
+    if has_option:
+        exercise_by_month = np.ascontiguousarray(np.asarray(exercise_mask, dtype=bool).T)
+        is_call = np.asarray(option_sign) == 1
+        is_put = np.asarray(option_sign) == -1
+        strikes = np.asarray(strikes, dtype=float)
+
+    # 普通节点的后继是相邻的三个节点，用切片代替按后继索引取值，避免每步复制整个矩阵
+    pu, pm, pd_ = (lattice[key][:, None] for key in ('pu', 'pm', 'pd'))
+    inner_u, inner_m, inner_d = pu[1:-1], pm[1:-1], pd_[1:-1]
+    step_discount = lattice['step_discount'][:, :, None]
+    values = np.zeros((width, num_bonds))
+    rolled = np.empty((width, num_bonds))
+    for m in range(steps, 0, -1):
+        if has_option and exercise_by_month[m].any():
+            exercisable = exercise_by_month[m]
+            values = np.where(exercisable & is_call, np.minimum(values, strikes), values)
+            values = np.where(exercisable & is_put, np.maximum(values, strikes), values)
+        values += cashflow_by_month[m]
+        # 从第m期回到第m-1期
+        np.multiply(inner_u, values[2:], out=rolled[1:-1])
+        rolled[1:-1] += inner_m * values[1:-1]
+        rolled[1:-1] += inner_d * values[:-2]
+        rolled[-1] = pu[-1] * values[-1] + pm[-1] * values[-2] + pd_[-1] * values[-3]
+        rolled[0] = pu[0] * values[2] + pm[0] * values[1] + pd_[0] * values[0]
+        rolled *= step_discount[m - 1]
+        values, rolled = rolled, values
+    return values[lattice['jmax']].copy()
+
+def preferred_cashflows(bond_data, date_list):
+    """
+    优先股现金流：自评估月起按付息频率派息至评估期末，末月按面值计终值
+    付息月按首个赎回日（maturity_date）所在月份推算，与cashflow_cal的付息月规则一致
+    """
+    months = len(date_list)
+    freq = bond_data['payment_freq'].to_numpy(dtype=float)
+    freq = np.where((freq == 98) | (freq == 99) | (freq == 0), 1, freq)
+    period = np.rint(12 / freq).astype(int)
+    anchor = bond_data['maturity_date'].dt.year.to_numpy() * 12 + bond_data['maturity_date'].dt.month.to_numpy()
+    col_month = np.array([date.year * 12 + date.month for date in date_list])
+    month_diff = np.abs(col_month[None, :] - anchor[:, None])
+    coupon = (bond_data['principal'] * bond_data['coupon_rate'] / 100).to_numpy(dtype=float) / freq
+    cashflows = np.where(month_diff % period[:, None] == 0, coupon[:, None], 0.0)
+    cashflows[:, months - 1] += bond_data['principal'].to_numpy(dtype=float)
+    return cashflows
+
+def exercise_schedule(bond_data, date_list, is_preferred):
+    """
+    行权月矩阵、行权金额和期权方向
+    首个行权日所在月起，每个付息周期（到期支付类每12个月）可行权一次，到期月不再单独行权
+    """
+    months = len(date_list)
+    num_bonds = len(bond_data)
+    if 'option_type' in bond_data.columns:
+        option_sign = bond_data['option_type'].map(option_map).fillna(0).to_numpy(dtype=int)
+    else:
+        option_sign = np.zeros(num_bonds, dtype=int)
+    # 未填写含权条款的优先股视为发行人自首个赎回日起可赎回
+    option_sign = np.where(is_preferred & (option_sign == 0), 1, option_sign)
+
+    if 'option_date' in bond_data.columns:
+        option_date = bond_data['option_date'].apply(parse_date)
+    else:
+        option_date = pd.Series(pd.NaT, index=bond_data.index)
+    # 未填写首个行权日时取maturity_date（优先股即首个赎回日）
+    option_date = pd.to_datetime(option_date).fillna(bond_data['maturity_date'])
+
+    if 'option_price' in bond_data.columns:
+        option_price = bond_data['option_price'].fillna(100).to_numpy(dtype=float)
+    else:
+        option_price = np.full(num_bonds, 100.0)
+    strikes = option_price / 100 * bond_data['principal'].to_numpy(dtype=float)
+
+    freq = bond_data['payment_freq'].to_numpy(dtype=float)
+    period = np.where((freq == 98) | (freq == 99) | (freq == 0), 12, np.rint(12 / np.where(freq == 0, 1, freq))).astype(int)
+    col_month = np.array([date.year * 12 + date.month for date in date_list])
+    first_month = option_date.dt.year.to_numpy() * 12 + option_date.dt.month.to_numpy()
+    maturity_month = bond_data['maturity_date'].dt.year.to_numpy() * 12 + bond_data['maturity_date'].dt.month.to_numpy()
+    month_diff = col_month[None, :] - first_month[:, None]
+    exercise_mask = (month_diff >= 0) & (month_diff % period[:, None] == 0)
+    # 普通债券到期月按到期兑付处理；优先股在评估期内均可行权
+    exercise_mask &= is_preferred[:, None] | (col_month[None, :] < maturity_month[:, None])
+    exercise_mask &= (option_sign != 0)[:, None]
+    exercise_mask[:, 0] = False
+    return exercise_mask, strikes, option_sign
+
+def lattice_valuation(file_path, start_date_str, monthly_df, a=0.05, sigma=0.01, months=601):
+    """
+    含权债券和优先股的期权调整估值，不含权债券直接折现
+
+    返回:
+    1.result: 见模块说明
+    """
+    # 债券文件只读取一次，现金流生成和含权字段处理共用
+    with pd.ExcelFile(file_path) as book:
+        bond_data = book.parse(0)
+        schedule = book.parse('还本计划') if '还本计划' in book.sheet_names else None
+    result_df, principal_result_df, coupon_result_df = generate_cashflows(bond_data, start_date_str, months=months, schedule=schedule)
+    if result_df is None:
+        raise ValueError(f"现金流生成失败: {file_path}")
+    cashflow_start_col = len(result_df.columns) - months
+    result = discount_cashflows(result_df, monthly_df, cashflow_start_col=cashflow_start_col)
+    result['valuation_method'] = 'discount'
+
+    # 与generate_cashflows相同的字段预处理
+    bond_data['payment_freq'] = bond_data['payment_freq'].map(freq_map).fillna(99)
+    bond_data['maturity_date'] = pd.to_datetime(bond_data['maturity_date'].apply(parse_date))
+    start_date = parse_date(start_date_str)
+    date_list = [get_last_day_of_month(start_date + relativedelta(months=i)) for i in range(months)]
+
+    is_preferred = (bond_data['product_type'] == "优先股").to_numpy() if 'product_type' in bond_data.columns \
+        else np.zeros(len(bond_data), dtype=bool)
+    exercise_mask, strikes, option_sign = exercise_schedule(bond_data, date_list, is_preferred)
+    lattice_rows = np.flatnonzero(is_preferred | (option_sign != 0))
+    if len(lattice_rows) == 0:
+        print("没有需要树模型估值的含权债券或优先股")
+        return result
+
+    # 含权债沿用generate_cashflows的现金流，优先股单独生成
+    cashflow_matrix = result_df.iloc[lattice_rows, cashflow_start_col:].to_numpy(dtype=float, copy=True)
+    preferred_rows = is_preferred[lattice_rows]
+    if preferred_rows.any():
+        cashflow_matrix[preferred_rows] = preferred_cashflows(bond_data.iloc[lattice_rows[preferred_rows]], date_list)
+
+    for pv_col, discount_col in [('pv', 'rate_discount'), ('pv_down', 'rate_down_discount'), ('pv_up', 'rate_up_discount')]:
+        lattice = build_hw_lattice(monthly_df[discount_col].to_numpy(dtype=float)[:months - 1], a=a, sigma=sigma)
+        pv = lattice_price(lattice, cashflow_matrix, exercise_mask[lattice_rows], strikes[lattice_rows], option_sign[lattice_rows])
+        result[pv_col] = result[pv_col].astype(float)
+        result.loc[result.index[lattice_rows], pv_col] = pv
+    result.loc[result.index[lattice_rows], 'valuation_method'] = 'lattice'
+    print(f"树模型估值完成：含权债券 {int((~preferred_rows).sum())} 只，优先股 {int(preferred_rows.sum())} 只")
+    return result
+
+
+if __name__ == "__main__":
+    config_path = input("参数配置文件:").strip()
+    config = read_config(config_path)
+    if not config:
+        sys.exit(1)
+    start_date = config.get("start_date")
+    monthly_df = build_monthly_df(config.get("curve_path"), config.get("stress_data"))
+    result = lattice_valuation(config.get("file_path"), start_date, monthly_df)
+    output_file = start_date + 'mc_lattice.xlsx'
+    result.to_excel(output_file)
+    print(f"期权调整估值已计算完成并保存到: {output_file}")
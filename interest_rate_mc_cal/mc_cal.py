@@ -1,5 +1,85 @@
 import pandas as pd
-def discount_cashflows(result_df, monthly_df, cashflow_start_col=5):
+import numpy as np
+from interest_curve_cal import apply_spread_to_monthly
+
+def build_risk_vectors(monthly_df, months=600):
+    """
+    生成风险指标模式下与三条折现因子并列的时间加权向量（均基于基础情景rate_discount）
+
+    参数:
+    1.monthly_df: 月度折现率表
+    2.months: 月数，默认600（month=1~600，期限t=month/12年）
+
+    返回:
+    1.risk_vectors: 形状[months, 5]，依次为 t·DF, t·DF/(1+y), t(t+1)·DF/(1+y)², t, 1
+       其中y为由DF反推的年复利即期利率 y=DF^(-1/t)-1，后两列用于计算加权平均期限
+    """
+    terms = np.arange(1, months + 1) / 12
+    base_discount = monthly_df['rate_discount'].to_numpy(dtype=float)[:months]
+    spot_factor = base_discount ** (-1 / terms)  # 1+y
+    return np.column_stack([
+        terms * base_discount,
+        terms * base_discount / spot_factor,
+        terms * (terms + 1) * base_discount / spot_factor ** 2,
+        terms,
+        np.ones(months)
+    ])
+
+def curve_factor_matrices(monthly_df, curves=None, risk_metrics=False):
+    """
+    多曲线折现时各曲线的折现因子矩阵
+
+    参数:
+    1.monthly_df: 基础月度折现率表，映射为空或未在curves中配置的债券使用该曲线
+    2.curves: {曲线标识: 月度折现率表或利差(bp)}，利差通过interest_curve_cal.apply_spread_to_monthly加在基础曲线上
+    3.risk_metrics: 是否拼接各曲线自己的风险指标向量
+
+    返回:
+    1.factors: {曲线标识: [600, 3或8]矩阵}，基础曲线的标识为None
+    """
+    factors = {}
+    for curve_id, curve in [(None, monthly_df)] + list((curves or {}).items()):
+        if not isinstance(curve, pd.DataFrame):
+            curve = apply_spread_to_monthly(monthly_df, float(curve))
+        matrix = curve[['rate_discount', 'rate_down_discount', 'rate_up_discount']].to_numpy(dtype=float)
+        if risk_metrics:
+            matrix = np.hstack([matrix, build_risk_vectors(curve)])
+        factors[curve_id] = matrix
+    return factors
+
+def grouped_matmul(cashflow_matrix, curve_ids, factors):
+    """
+    按曲线分组的矩阵乘法：债券按曲线标识排序后每组一次矩阵乘法，结果按原行号写回
+
+    参数:
+    1.cashflow_matrix: [债券数, 600]现金流矩阵
+    2.curve_ids: 每行的曲线标识
+    3.factors: curve_factor_matrices的返回值
+
+    返回:
+    1.discounted_matrix: [债券数, 折现因子列数]
+    """
+    codes, uniques = pd.factorize(pd.Series(curve_ids))
+    # 空值和未配置的曲线标识归入基础曲线
+    unknown = [str(curve_id) for curve_id in uniques if curve_id not in factors and curve_id != '']
+    if unknown:
+        print(f"⚠️ 以下曲线标识未配置，使用基础曲线: {', '.join(unknown)}")
+    group_factors = [factors.get(curve_id, factors[None]) for curve_id in uniques] + [factors[None]]
+    codes = np.where(codes < 0, len(uniques), codes)
+    if len(np.unique(codes)) == 1:
+        return cashflow_matrix @ group_factors[codes[0]]
+
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(group_factors) + 1))
+    discounted_matrix = np.empty((len(cashflow_matrix), factors[None].shape[1]))
+    for k, matrix in enumerate(group_factors):
+        rows = order[bounds[k]:bounds[k + 1]]
+        if len(rows):
+            discounted_matrix[rows] = cashflow_matrix[rows] @ matrix
+    return discounted_matrix
+
+def discount_cashflows(result_df, monthly_df, cashflow_start_col=5, risk_metrics=False, principal_result_df=None,
+                       curve_col=None, curves=None):
     """
     使用矩阵运算对按列存储的现金流进行折现,三条曲线得到pv,pv_down,pv_up
     
@@ -8,9 +88,20 @@ def discount_cashflows(result_df, monthly_df, cashflow_start_col=5):
     2.monthly_df: 月度折现率表（包含600个月的折现因子）
     3.cashflow_start_col: 现金流起始列索引，需要根据cashflow_cal中metadata字典配置数量（账户，代码，名称等）设置
     4.output_file：main中写入excel文件的路径
+    5.risk_metrics: 是否同时计算久期、凸性和加权平均期限（基础情景）
+    6.principal_result_df: 风险指标模式下可选，传入本金现金流表时加权平均期限按本金计算，否则按总现金流计算
+    7.curve_col: 多曲线模式下的曲线映射字段（result_df中的元数据列，如generate_cashflows(curve_col='curve_id')输出的
+      curve_id，也可直接用product_type），默认None为单曲线
+    8.curves: {曲线标识: 月度折现率表或利差(bp)}，见curve_factor_matrices
     
     返回:
     1.result:包含三个情景折现值的DataFramepv,包含pv,pv_down,pv_up
+      risk_metrics=True时增加macaulay_duration,modified_duration,convexity,wal（单位：年）
+
+    说明：风险指标模式把build_risk_vectors的5列拼在三条折现因子之后组成600×8矩阵，
+    所有指标来自同一次矩阵乘法，额外计算量可以忽略。
+    多曲线模式下债券按曲线分组，每组与该组的600×3（或600×8）矩阵做一次矩阵乘法后写回原行，
+    总计算量与单曲线相同，久期等指标按各自曲线计算。
     """
     
     # 提取现金流列（从cashflow_start_col开始到最后一列）
@@ -23,18 +114,33 @@ def discount_cashflows(result_df, monthly_df, cashflow_start_col=5):
     # 提取后600个月的现金流列（month=2~601）
     cashflow_cols = cashflow_cols[1:]  # 跳过第1个月
     
-    # 提取三个情景的折现因子（month=1~600）
+    # 提取三个情景的折现因子（month=1~600），转为float64，避免object类型逐元素运算
     discount_factors = monthly_df[[
         'rate_discount',
         'rate_down_discount',
         'rate_up_discount'
-    ]].values
+    ]].to_numpy(dtype=float)
     
-    # 将现金流数据转换为NumPy数组（形状：[资产数, 600个月]）
-    cashflow_matrix = result_df[cashflow_cols].values
+    # 将现金流数据转换为NumPy数组（形状：[资产数, 600个月]），按位置切片，避免按列名选取再复制一次
+    cashflow_matrix = result_df.iloc[:, cashflow_start_col + 1:].to_numpy()
     
+    if risk_metrics:
+        # 折现因子后拼接时间加权向量，形状：[600, 8]
+        discount_factors = np.hstack([discount_factors, build_risk_vectors(monthly_df)])
+        if principal_result_df is not None:
+            # 本金现金流接在总现金流下方，仍只做一次矩阵乘法
+            principal_matrix = principal_result_df.iloc[:, cashflow_start_col + 1:].values
+            cashflow_matrix = np.vstack([cashflow_matrix, principal_matrix])
+
     # 矩阵乘法计算折现值（每个资产在每个情景下的总折现值）
-    discounted_matrix = cashflow_matrix @ discount_factors
+    if curve_col is None:
+        discounted_matrix = cashflow_matrix @ discount_factors
+    else:
+        curve_ids = result_df[curve_col].to_numpy(dtype=object)
+        if risk_metrics and principal_result_df is not None:
+            curve_ids = np.concatenate([curve_ids, curve_ids])
+        discounted_matrix = grouped_matmul(np.asarray(cashflow_matrix, dtype=float), curve_ids,
+                                           curve_factor_matrices(monthly_df, curves, risk_metrics))
     
     # 创建结果DataFrame
     result = pd.DataFrame({
@@ -43,13 +149,102 @@ def discount_cashflows(result_df, monthly_df, cashflow_start_col=5):
         'product_type': result_df.iloc[:, 2],
         'bond_code': result_df.iloc[:, 3],
         'bond_name': result_df.iloc[:, 4],
-        'pv': discounted_matrix[:, 0],
-        'pv_down': discounted_matrix[:, 1],
-        'pv_up': discounted_matrix[:, 2]
+        'pv': discounted_matrix[:len(result_df), 0],
+        'pv_down': discounted_matrix[:len(result_df), 1],
+        'pv_up': discounted_matrix[:len(result_df), 2]
     })
-    
+
+    if risk_metrics:
+        n = len(result_df)
+        totals = discounted_matrix[:n]
+        wal_totals = discounted_matrix[n:] if principal_result_df is not None else totals
+        pv = totals[:, 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result['macaulay_duration'] = np.where(pv != 0, totals[:, 3] / pv, np.nan)
+            result['modified_duration'] = np.where(pv != 0, totals[:, 4] / pv, np.nan)
+            result['convexity'] = np.where(pv != 0, totals[:, 5] / pv, np.nan)
+            result['wal'] = np.where(wal_totals[:, 7] != 0, wal_totals[:, 6] / wal_totals[:, 7], np.nan)
+
     return result
 
+def discount_compact(compact, monthly_df, chunk_rows=4096, risk_metrics=False):
+    """
+    对cashflow_cal紧凑模式（compact=True）返回的现金流进行折现，结果与discount_cashflows格式相同
+
+    参数:
+    1.compact: generate_cashflows(..., compact=True)返回的字典
+    2.monthly_df: 月度折现率表
+    3.chunk_rows: 每次转为float64参与矩阵乘法的行数，控制临时内存
+    4.risk_metrics: 同discount_cashflows，加权平均期限按本金计算
+
+    返回:
+    1.result: pv,pv_down,pv_up（及风险指标），元数据列为category类型
+
+    说明：现金流以float32存储时，逐块转为float64后与float64折现因子相乘，累加精度与float64一致，
+    误差仅来自float32存储本身，误差界见cashflow_cal说明。
+    """
+    result_matrix = compact['result']
+    if result_matrix.shape[1] != 601:
+        raise ValueError(f"现金流列数量应为601，但实际为{result_matrix.shape[1]}")
+
+    discount_factors = monthly_df[[
+        'rate_discount',
+        'rate_down_discount',
+        'rate_up_discount'
+    ]].to_numpy(dtype=float)
+    if risk_metrics:
+        discount_factors = np.hstack([discount_factors, build_risk_vectors(monthly_df)])
+
+    num_bonds = len(result_matrix)
+    discounted_matrix = np.empty((num_bonds, discount_factors.shape[1]))
+    principal_matrix = compact['principal'] if risk_metrics else None
+    principal_totals = np.empty_like(discounted_matrix) if risk_metrics else None
+    for start in range(0, num_bonds, chunk_rows):
+        end = min(start + chunk_rows, num_bonds)
+        # 跳过第1个月，按块转为float64
+        discounted_matrix[start:end] = result_matrix[start:end, 1:].astype(np.float64) @ discount_factors
+        if risk_metrics:
+            principal_totals[start:end] = principal_matrix[start:end, 1:].astype(np.float64) @ discount_factors
+
+    result = compact['meta'].copy()
+    result['pv'] = discounted_matrix[:, 0]
+    result['pv_down'] = discounted_matrix[:, 1]
+    result['pv_up'] = discounted_matrix[:, 2]
+
+    if risk_metrics:
+        pv = discounted_matrix[:, 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result['macaulay_duration'] = np.where(pv != 0, discounted_matrix[:, 3] / pv, np.nan)
+            result['modified_duration'] = np.where(pv != 0, discounted_matrix[:, 4] / pv, np.nan)
+            result['convexity'] = np.where(pv != 0, discounted_matrix[:, 5] / pv, np.nan)
+            result['wal'] = np.where(principal_totals[:, 7] != 0, principal_totals[:, 6] / principal_totals[:, 7], np.nan)
+
+    return result
+
+
+def discount_events(events, meta, grid):
+    """
+    精确日期折现：按支付日在逐日折现因子表中取值（一次索引），再按债券汇总
+
+    参数:
+    1.events: cashflow_cal.generate_cashflow_events返回的事件表（bond_index, pay_date, amount）
+    2.meta: 对应的元数据表，行号与bond_index一致
+    3.grid: interest_curve_cal.build_daily_discount_grid返回的逐日折现因子表
+
+    返回:
+    1.result: 与discount_cashflows格式相同，pv,pv_down,pv_up
+    """
+    day_index = (events['pay_date'].to_numpy(dtype='datetime64[D]') - grid['start_date']).astype(int)
+    if len(day_index) and (day_index.min() < 0 or day_index.max() >= len(grid['discount'])):
+        raise ValueError(f"支付日超出折现因子表范围（评估日后0~{len(grid['discount']) - 1}天）")
+    discounted = grid['discount'][day_index] * events['amount'].to_numpy(dtype=float)[:, None]
+    bond_index = events['bond_index'].to_numpy()
+
+    result = meta.copy().reset_index(drop=True)
+    scenario_cols = {'rate_discount': 'pv', 'rate_down_discount': 'pv_down', 'rate_up_discount': 'pv_up'}
+    for k, col in enumerate(grid['columns']):
+        result[scenario_cols.get(col, col)] = np.bincount(bond_index, discounted[:, k], minlength=len(meta))
+    return result
 
 if __name__=="__main__":
     date = '20241231'
@@ -0,0 +1,249 @@
+import sys
+import numpy as np
+import pandas as pd
+from cashflow_cal import generate_cashflows
+from interest_curve_cal import build_monthly_df
+from mc_cal import discount_cashflows
+from tools import read_config
+
+"""
+模型点压缩：把逐券现金流按关键期限利率敏感度聚类为几百个模型点，用于日内假设分析和大规模情景计算
+参数：
+1.result_df：cashflow_cal返回的总现金流表（5个元数据列+601个月现金流列）
+2.monthly_df：interest_curve_cal返回的月度折现率表，聚类和误差检验以基础情景rate_discount为准
+3.n_points：模型点总数，默认300，按各组债券数量分配到group_cols分组
+4.group_cols：分组字段，默认account_1，模型点不跨组，账户层面的汇总不受压缩影响
+5.method：'medoid'取每类中最接近类中心的债券，现金流按该类基础情景pv缩放（模型点为真实债券的缩放，
+  可继续用于lattice_cal等非线性估值）；'aggregate'直接合并该类全部现金流（对线性折现各情景均无误差）
+返回：
+1.compressed_df：与result_df格式相同的模型点现金流表，bond_code为MP0001等，可直接传给discount_cashflows
+2.mapping：原持仓行号、所属模型点及缩放系数
+说明：
+1.聚类特征为单位pv的关键期限利率敏感度（KRD/pv），即现金流现值在各关键期限上的分布形状；
+  按|pv|加权的k-means++，每组独立聚类
+2.compression_diagnostics比较全量与模型点在pv,pv_down,pv_up及各关键期限敏感度上的误差，
+  validate_model_points按容差检查，建议定期用全量持仓复核
+"""
+
+KEY_RATE_TERMS = [1, 2, 3, 5, 7, 10, 15, 20, 30, 50]
+SCENARIO_COLS = ['pv', 'pv_down', 'pv_up']
+
+def key_rate_weights(months=600, key_terms=None):
+    """
+    关键期限三角权重矩阵[months, 关键期限数]，相邻关键期限间线性插值，首尾两端外推为1，每行权重之和为1
+    """
+    key_terms = np.asarray(KEY_RATE_TERMS if key_terms is None else key_terms, dtype=float)
+    terms = np.arange(1, months + 1) / 12
+    weights = np.empty((months, len(key_terms)))
+    for k in range(len(key_terms)):
+        unit = np.zeros(len(key_terms))
+        unit[k] = 1.0
+        weights[:, k] = np.interp(terms, key_terms, unit)
+    return weights
+
+def key_rate_vectors(monthly_df, months=600, key_terms=None):
+    """
+    关键期限敏感度向量：现金流矩阵乘以该矩阵即得各关键期限利率上升1bp（连续复利平移）时pv的减少额
+    """
+    terms = np.arange(1, months + 1) / 12
+    base_discount = monthly_df['rate_discount'].to_numpy(dtype=float)[:months]
+    return (terms * base_discount)[:, None] * key_rate_weights(months, key_terms) * 1e-4
+
+def valuation_vectors(monthly_df, months=600, key_terms=None):
+    """三条曲线折现因子与关键期限敏感度向量并列，一次矩阵乘法得到pv,pv_down,pv_up和各关键期限敏感度"""
+    discount_factors = monthly_df[['rate_discount', 'rate_down_discount', 'rate_up_discount']].to_numpy(dtype=float)[:months]
+    return np.hstack([discount_factors, key_rate_vectors(monthly_df, months, key_terms)])
+
+def weighted_kmeans(features, weights, n_clusters, seed=0, max_iter=100):
+    """
+    按权重的k-means++聚类
+
+    返回:
+    1.labels: 每行所属类别
+    2.centers: 类中心
+    """
+    num_rows = len(features)
+    if n_clusters >= num_rows:
+        return np.arange(num_rows), features.copy()
+    rng = np.random.default_rng(seed)
+    weights = weights / weights.sum()
+    squared_norms = (features ** 2).sum(axis=1)
+
+    # k-means++初始化：按与已有中心的距离平方乘以权重抽样
+    centers = np.empty((n_clusters, features.shape[1]))
+    centers[0] = features[rng.choice(num_rows, p=weights)]
+    closest = ((features - centers[0]) ** 2).sum(axis=1)
+    for k in range(1, n_clusters):
+        probabilities = weights * closest
+        total = probabilities.sum()
+        index = rng.choice(num_rows, p=probabilities / total) if total > 0 else rng.integers(num_rows)
+        centers[k] = features[index]
+        closest = np.minimum(closest, ((features - centers[k]) ** 2).sum(axis=1))
+
+    labels = np.full(num_rows, -1)
+    for _ in range(max_iter):
+        distances = squared_norms[:, None] - 2 * features @ centers.T + (centers ** 2).sum(axis=1)[None, :]
+        new_labels = distances.argmin(axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        cluster_weights = np.bincount(labels, weights, n_clusters)
+        for j in range(features.shape[1]):
+            sums = np.bincount(labels, weights * features[:, j], n_clusters)
+            # 空类保留原中心
+            centers[:, j] = np.where(cluster_weights > 0, sums / np.where(cluster_weights > 0, cluster_weights, 1), centers[:, j])
+    return labels, centers
+
+def allocate_points(group_sizes, n_points):
+    """按各组债券数量分配模型点数（最大余数法），每组至少1个且不超过组内债券数"""
+    group_sizes = np.asarray(group_sizes)
+    n_points = max(int(n_points), len(group_sizes))
+    quota = group_sizes / group_sizes.sum() * n_points
+    points = np.maximum(np.floor(quota).astype(int), 1)
+    remainder = quota - np.floor(quota)
+    for index in np.argsort(-remainder):
+        if points.sum() >= n_points:
+            break
+        points[index] += 1
+    return np.minimum(points, group_sizes)
+
+def compress_portfolio(result_df, monthly_df, n_points=300, group_cols=('account_1',), method='medoid',
+                       cashflow_start_col=5, key_terms=None, seed=0):
+    """
+    把逐券现金流压缩为模型点
+
+    参数:
+    见模块说明
+
+    返回:
+    1.compressed_df: 模型点现金流表
+    2.mapping: DataFrame，row（原持仓行号）、model_point、scale（medoid法下模型点=代表债券现金流×scale）
+    """
+    if method not in ('medoid', 'aggregate'):
+        raise ValueError("method应为'medoid'或'aggregate'")
+    group_cols = list(group_cols or [])
+    cashflow_matrix = result_df.iloc[:, cashflow_start_col:].to_numpy(dtype=float)
+    if cashflow_matrix.shape[1] != 601:
+        raise ValueError(f"现金流列数量应为601，但实际为{cashflow_matrix.shape[1]}")
+    metadata = result_df.iloc[:, :cashflow_start_col]
+
+    valuations = cashflow_matrix[:, 1:] @ valuation_vectors(monthly_df, key_terms=key_terms)
+    pv = valuations[:, 0]
+    # 已到期或现金流为0的持仓不参与压缩
+    active = pv > 0
+    features = np.zeros((len(pv), valuations.shape[1] - 3))
+    features[active] = valuations[active, 3:] / pv[active, None]
+
+    if group_cols:
+        group_keys = metadata[group_cols].astype(str).agg('|'.join, axis=1).to_numpy()
+    else:
+        group_keys = np.full(len(metadata), '')
+    groups = [np.flatnonzero(active & (group_keys == key)) for key in pd.unique(group_keys[active])]
+    points_per_group = allocate_points([len(rows) for rows in groups], n_points)
+
+    point_rows, point_cashflows, mapping = [], [], []
+    for rows, n_clusters in zip(groups, points_per_group):
+        labels, centers = weighted_kmeans(features[rows], pv[rows], n_clusters, seed=seed)
+        for label in np.unique(labels):
+            members = rows[labels == label]
+            cluster_pv = pv[members].sum()
+            model_point = f"MP{len(point_rows) + 1:04d}"
+            # 代表债券：类内与类中心距离最近的债券
+            medoid = members[((features[members] - centers[label]) ** 2).sum(axis=1).argmin()]
+            if method == 'medoid':
+                scale = cluster_pv / pv[medoid]
+                point_cashflows.append(cashflow_matrix[medoid] * scale)
+            else:
+                scale = np.nan
+                point_cashflows.append(cashflow_matrix[members].sum(axis=0))
+            point_rows.append(medoid)
+            mapping.append(pd.DataFrame({'row': members, 'model_point': model_point, 'scale': scale}))
+
+    compressed_df = metadata.iloc[point_rows].reset_index(drop=True).copy()
+    compressed_df.iloc[:, 3] = [f"MP{i + 1:04d}" for i in range(len(point_rows))]
+    members_count = pd.concat(mapping)['model_point'].value_counts()
+    compressed_df.iloc[:, 4] = [f"{name}等{members_count[code]}只" for name, code
+                                in zip(metadata.iloc[point_rows, 4].astype(str), compressed_df.iloc[:, 3])]
+    cashflow_df = pd.DataFrame(np.vstack(point_cashflows), columns=result_df.columns[cashflow_start_col:])
+    compressed_df = pd.concat([compressed_df, cashflow_df], axis=1)
+    mapping = pd.concat(mapping, ignore_index=True).sort_values('row', ignore_index=True)
+    print(f"模型点压缩完成：{int(active.sum())} 条持仓 → {len(compressed_df)} 个模型点（{method}）")
+    return compressed_df, mapping
+
+def compression_diagnostics(result_df, compressed_df, monthly_df, group_cols=('account_1',), cashflow_start_col=5, key_terms=None):
+    """
+    全量持仓与模型点的误差诊断
+
+    返回:
+    1.diagnostics: DataFrame，每个分组（及合计）一行，包含pv,pv_down,pv_up和各关键期限敏感度（krd_1y等）的
+      全量值、模型点值、相对误差（_rel_err）；关键期限敏感度另给出相对该组总敏感度的误差（_share_err）
+    """
+    key_terms = KEY_RATE_TERMS if key_terms is None else key_terms
+    measures = SCENARIO_COLS + [f"krd_{term}y" for term in key_terms]
+    vectors = valuation_vectors(monthly_df, key_terms=key_terms)
+    group_cols = list(group_cols or [])
+
+    def totals(df):
+        values = pd.DataFrame(df.iloc[:, cashflow_start_col + 1:].to_numpy(dtype=float) @ vectors, columns=measures)
+        if not group_cols:
+            return values.sum().to_frame().T
+        values = pd.concat([df[group_cols].reset_index(drop=True).astype(str), values], axis=1)
+        grouped = values.groupby(group_cols).sum()
+        grouped.loc[('合计',) * len(group_cols) if len(group_cols) > 1 else '合计'] = values[measures].sum()
+        return grouped
+
+    full, compressed = totals(result_df), totals(compressed_df).reindex(totals(result_df).index).fillna(0)
+    diagnostics = pd.DataFrame(index=full.index)
+    krd_cols = measures[3:]
+    total_krd = full[krd_cols].abs().sum(axis=1)
+    for col in measures:
+        diagnostics[f"{col}_full"] = full[col]
+        diagnostics[f"{col}_model"] = compressed[col]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            diagnostics[f"{col}_rel_err"] = np.where(full[col] != 0, (compressed[col] - full[col]) / full[col], np.nan)
+            if col in krd_cols:
+                diagnostics[f"{col}_share_err"] = np.where(total_krd != 0, (compressed[col] - full[col]) / total_krd, np.nan)
+    return diagnostics.reset_index()
+
+def validate_model_points(result_df, compressed_df, monthly_df, group_cols=('account_1',), pv_tolerance=1e-3,
+                          krd_tolerance=1e-2, cashflow_start_col=5, key_terms=None):
+    """
+    用全量持仓复核模型点：三情景pv相对误差不超过pv_tolerance，各关键期限敏感度误差（占该组总敏感度）
+    不超过krd_tolerance
+
+    返回:
+    1.passed: 是否全部通过
+    2.diagnostics: compression_diagnostics的结果
+    """
+    diagnostics = compression_diagnostics(result_df, compressed_df, monthly_df, group_cols, cashflow_start_col, key_terms)
+    pv_errors = diagnostics[[f"{col}_rel_err" for col in SCENARIO_COLS]].abs().max().max()
+    krd_errors = diagnostics[[col for col in diagnostics.columns if col.endswith('_share_err')]].abs().max().max()
+    passed = bool(pv_errors <= pv_tolerance and krd_errors <= krd_tolerance)
+    if passed:
+        print(f"✅ 模型点复核通过：pv最大相对误差 {pv_errors:.2e}，关键期限敏感度最大误差 {krd_errors:.2e}")
+    else:
+        print(f"⚠️ 模型点误差超出容差：pv最大相对误差 {pv_errors:.2e}（容差{pv_tolerance:.0e}），"
+              f"关键期限敏感度最大误差 {krd_errors:.2e}（容差{krd_tolerance:.0e}），建议增加模型点数量后重新压缩")
+    return passed, diagnostics
+
+
+if __name__ == "__main__":
+    config_path = input("参数配置文件:").strip()
+    config = read_config(config_path)
+    if not config:
+        sys.exit(1)
+    n_points = input("模型点数量 (默认300):").strip()
+    n_points = int(n_points) if n_points else 300
+
+    start_date = config.get("start_date")
+    result_df, principal_result_df, coupon_result_df = generate_cashflows(config.get("file_path"), start_date, months=601)
+    monthly_df = build_monthly_df(config.get("curve_path"), config.get("stress_data"))
+    compressed_df, mapping = compress_portfolio(result_df, monthly_df, n_points=n_points)
+    passed, diagnostics = validate_model_points(result_df, compressed_df, monthly_df)
+
+    output_file = start_date + 'model_points.xlsx'
+    with pd.ExcelWriter(output_file) as writer:
+        discount_cashflows(compressed_df, monthly_df).to_excel(writer, sheet_name='模型点估值')
+        mapping.to_excel(writer, sheet_name='持仓映射', index=False)
+        diagnostics.to_excel(writer, sheet_name='误差诊断', index=False)
+    print(f"模型点结果已保存到: {output_file}")
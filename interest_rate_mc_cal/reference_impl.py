@@ -0,0 +1,443 @@
+import pandas as pd
+import numpy as np
+from dateutil.relativedelta import relativedelta
+from tqdm import tqdm
+
+"""
+冻结的参考实现，供diff_harness做差异比对
+内容为基线版本的parse_date、get_last_day_of_month、is_same_month、generate_cashflows（cashflow_cal）、
+interpolate_rate_curve、annual_to_monthly（interest_curve_cal）和discount_cashflows（mc_cal）原样拷贝，
+仅做了不影响数值的环境兼容修改（已在对应位置注释）。
+请勿修改本文件：生产代码的任何优化都应通过diff_harness与这里的结果比对。
+"""
+
+def parse_date(date_str):
+    """
+    将日期字符串/Excel 序列值转换为 datetime 对象（支持多种格式）
+    - 字符串格式：YYYYMMDD、YYYY-MM-DD、YYYY/MM/DD 等
+    - Excel 序列值：数值型（如 44000 对应 2020-01-01）
+    """
+    if pd.isna(date_str):  # 处理空值
+        return pd.NaT
+    
+    # 处理 Excel 日期序列值（数值类型）
+    if isinstance(date_str, (int, float)):
+        try:
+            # Excel 通常从 1900-01-01 开始（序列值 1），但需处理 1900 年非闰年的 bug
+            # 参考：https://support.microsoft.com/en-us/help/214330
+            return pd.to_datetime(date_str, origin='1899-12-30', unit='D')
+        except:
+            pass  # 若转换失败，尝试按字符串处理
+    
+    # 处理日期字符串
+    if isinstance(date_str, str):
+        date_str = date_str.strip()
+        # 支持的格式：YYYYMMDD、YYYY-MM-DD、MM/DD/YYYY 等
+        for fmt in ['%Y%m%d', '%Y-%m-%d', '%m/%d/%Y', '%Y/%m/%d']:
+            try:
+                return pd.to_datetime(date_str, format=fmt)
+            except:
+                pass
+        # 尝试自动解析（处理模糊格式）
+        try:
+            return pd.to_datetime(date_str, errors='coerce')  # 容错处理
+        except:
+            pass
+    
+    # 处理其他类型（如 pd.Timestamp）
+    try:
+        return pd.to_datetime(date_str)
+    except:
+        raise ValueError(f"无法解析的日期格式：{date_str}")
+
+def get_last_day_of_month(date):
+    """获取月份的最后一天"""
+    next_month = date.replace(day=28) + relativedelta(days=4)
+    return next_month - relativedelta(days=next_month.day)
+
+def is_same_month(date1, date2):
+    """判断两个日期是否在同一个月"""
+    return date1.year == date2.year and date1.month == date2.month
+
+def generate_cashflows(file_path, start_date_str, months=360):
+    """从Excel读取债券数据，生成现金流表（修复数组广播错误）"""
+    try:
+        # 读取Excel文件
+        bond_data = pd.read_excel(file_path)
+        
+        # 检查必要的列是否存在
+        required_columns = ['principal', 'issue_date', 'maturity_date', 'coupon_rate', 'payment_freq']
+        missing_columns = [col for col in required_columns if col not in bond_data.columns]
+        
+        if missing_columns:
+            raise ValueError(f"Excel文件缺少必要的列: {', '.join(missing_columns)}")
+        
+        freq_map = {
+            '年付': 1,    # 每年支付1次
+            '半年付': 2,   # 每半年支付1次
+            '季付': 4,     # 每季度支付1次
+            '月付': 12,    # 每月支付1次  
+            '一次性还本付息': 99,  # 到期一次性支付（期末）
+            '到期支付': 98,     # 到期支付
+            # 可根据需要添加更多映射
+        }
+        
+        # 将付款频率映射为数值
+        bond_data['payment_freq'] = bond_data['payment_freq'].map(freq_map).fillna(99)
+        
+        # 转换日期列
+        bond_data['issue_date'] = bond_data['issue_date'].apply(parse_date)
+        bond_data['maturity_date'] = bond_data['maturity_date'].apply(parse_date)
+        bond_data['maturity_date_end'] = bond_data['maturity_date'].apply(get_last_day_of_month)
+        
+        # 计算持有年数
+        bond_data['years_held'] = (bond_data['maturity_date'] - bond_data['issue_date']).dt.days / 365
+        
+        start_date = parse_date(start_date_str)
+        
+        # 生成未来N个月的月末日期
+        date_list = [get_last_day_of_month(start_date + relativedelta(months=i)) 
+                    for i in range(months)]
+        date_indices = {date.strftime('%Y%m'): i for i, date in enumerate(date_list)}
+        
+        # 创建结果数组，初始化为0
+        num_bonds = len(bond_data)
+        result = np.zeros((num_bonds, months), dtype=float)  # 本金+利息
+        principal_result = np.zeros((num_bonds, months), dtype=float)  # 本金+到期一次还本付息
+        coupon_result = np.zeros((num_bonds, months), dtype=float)  # 票息
+        
+        # 创建日期矩阵（每个债券对应所有计算日期）
+        date_matrix = np.array(date_list, dtype='datetime64[D]')
+        date_matrix = np.tile(date_matrix, (num_bonds, 1))
+        
+        # 创建债券属性矩阵（确保所有矩阵形状一致）
+        principal_matrix = np.tile(bond_data['principal'].values.reshape(-1, 1), (1, months))
+        coupon_rate_matrix = np.tile((bond_data['coupon_rate']/100).values.reshape(-1, 1), (1, months))
+        payment_freq_matrix = np.tile(bond_data['payment_freq'].values.reshape(-1, 1), (1, months))
+        maturity_date_matrix = np.tile(bond_data['maturity_date'].values.reshape(-1, 1), (1, months))
+        maturity_date_end_matrix = np.tile(bond_data['maturity_date_end'].values.reshape(-1, 1), (1, months))
+        years_held_matrix = np.tile(bond_data['years_held'].values.reshape(-1, 1), (1, months))
+        # 环境兼容：转为object数组再reshape（pandas使用pyarrow字符串类型时.values不支持reshape）
+        product_type_matrix = np.tile(bond_data['product_type'].to_numpy(dtype=object).reshape(-1, 1), (1, months))
+        
+        # 向量化计算月份差异
+        month_diff_matrix = np.zeros((num_bonds, months), dtype=int)
+        
+        # 将NumPy datetime64转换为年、月数组
+        maturity_years = maturity_date_matrix.astype('datetime64[Y]').astype(int) + 1970
+        maturity_months = maturity_date_matrix.astype('datetime64[M]').astype(int) % 12 + 1
+        
+        for i in range(months):
+            current_date = date_list[i]
+            current_year = current_date.year
+            current_month = current_date.month
+            
+            # 计算月份差异
+            month_diff = (current_year - maturity_years[:, i]) * 12 + (current_month - maturity_months[:, i])
+            month_diff_matrix[:, i] = month_diff
+        
+        month_diff_abs_matrix = np.abs(month_diff_matrix)
+        
+        # 向量化计算每个月的现金流
+        for j in tqdm(range(months), desc="计算现金流", unit="月", ncols=80):
+            current_date = date_list[j]
+
+            # 创建掩码矩阵
+            is_maturity_month = np.vectorize(lambda x: is_same_month(current_date, pd.Timestamp(x)))(maturity_date_matrix[:, j])
+            is_before_maturity = date_matrix[:, j] <= maturity_date_end_matrix[:, j]
+            is_not_perpetual = product_type_matrix[:, j] != "优先股"
+            is_freq_98 = payment_freq_matrix[:, j] == 98
+            is_freq_99 = payment_freq_matrix[:, j] == 99
+            freq_not_zero = payment_freq_matrix[:, j] != 0
+
+            # 计算第一部分：基础本金支付（确保freq=98只在到期月支付本金）
+            part1_mask = is_not_perpetual & ((is_freq_98 & is_maturity_month) | (~is_freq_98 & is_maturity_month))
+            part1 = np.zeros(num_bonds)
+            part1[part1_mask] = principal_matrix[part1_mask, j]
+
+            # 计算第二部分：到期利息支付（排除freq=98的债券）
+            part2_mask = is_not_perpetual & is_maturity_month & is_freq_99
+            part2 = np.zeros(num_bonds)
+            part2[part2_mask] = principal_matrix[part2_mask, j] * \
+                              coupon_rate_matrix[part2_mask, j] * \
+                              years_held_matrix[part2_mask, j]
+
+            # 计算第三部分：常规利息支付（排除freq=98的债券）
+            valid_regular_interest = is_not_perpetual & is_before_maturity & ~(is_freq_98 | is_freq_99)
+            part3_condition = (month_diff_abs_matrix[:, j] % (12 / payment_freq_matrix[:, j])) == 0
+            part3_mask = valid_regular_interest & freq_not_zero & part3_condition
+
+            part3 = np.zeros(num_bonds)
+            part3[part3_mask] = principal_matrix[part3_mask, j] * \
+                              coupon_rate_matrix[part3_mask, j] / \
+                              payment_freq_matrix[part3_mask, j]
+
+            # 累加三部分现金流
+            result[:, j] =part1 + part2 + part3
+            principal_result[:, j] = part1
+            coupon_result[:, j] = part2 + part3
+        
+        # 转换为DataFrame
+        columns = [date.strftime('%Y%m') for date in date_list]
+        result_df = pd.DataFrame(result, columns=columns)
+        principal_result_df = pd.DataFrame(principal_result, columns=columns)
+        coupon_result_df = pd.DataFrame(coupon_result, columns=columns)
+        
+        # 添加债券ID、名称、账户
+        metadata_fields = [
+            ('account_1', lambda: bond_data['account_1'] if 'account_1' in bond_data.columns else ''),
+            ('account_2', lambda: bond_data['account_2'] if 'account_2' in bond_data.columns else ''),
+            ('product_type', lambda: bond_data['product_type'] if 'product_type' in bond_data.columns else ''),
+            ('bond_code', lambda: bond_data['bond_code'] if 'bond_code' in bond_data.columns else ''),
+            ('bond_name', lambda: bond_data['bond_name'] if 'bond_name' in bond_data.columns else '')
+        ]
+        
+        for df in [result_df, principal_result_df, coupon_result_df]:
+            for idx, (field_name, value_getter) in enumerate(metadata_fields):
+                df.insert(idx, field_name, value_getter())
+        
+        return result_df, principal_result_df, coupon_result_df
+    
+    except Exception as e:
+        print(f"处理Excel文件时出错: {str(e)}")
+        return None, None, None
+
+def interpolate_rate_curve(rate_curve_df, stress_param_df, ultimate_rate=4.5, premium_base_1=0.45,premium_base_2=0):
+    """
+    对利率曲线进行两次插值、溢价调整并转远期计算
+    计算 rate_up 和 rate_down 时使用调整后的 ultimate_rate
+    
+    参数:
+    - rate_curve_df: 包含 rate、rate_up、rate_down 列的 DataFrame
+    - stress_param_df: 压力参数表，用于获取调整系数
+    - ultimate_rate: 基础终极利率（%前数字）
+    - premium_base_1: 短期（<=20年）基础溢价（%前数字）
+    - premium_base_2: 长期（>=41年）基础溢价（%前数字）
+    
+    返回:
+    - 处理后的利率曲线 DataFrame
+    """
+    rate_curve_df = rate_curve_df.sort_values('date').copy()
+    
+    # 创建压力参数映射字典
+    up_param_map = dict(zip(stress_param_df['期限'], stress_param_df['利率向上压力参数']))
+    down_param_map = dict(zip(stress_param_df['期限'], stress_param_df['利率向下压力参数']))
+    
+    # 对每列（rate、rate_up、rate_down）执行完整处理
+    for col_prefix in ['rate', 'rate_up', 'rate_down']:
+        # 获取当前处理的列名
+        base_col = col_prefix
+        rate_1_col = f"{col_prefix}_1"
+        rate_2_col = f"{col_prefix}_2"
+        rate_3_col = f"{col_prefix}_3"
+        rate_4_col = f"{col_prefix}_4"
+        
+        # 确保基础列存在
+        if base_col not in rate_curve_df.columns:
+            print(f"⚠️ 警告：DataFrame 中不存在列 '{base_col}'，跳过处理")
+            continue
+        
+        # 计算当前列的 ultimate_rate（仅 rate_up 和 rate_down 需要调整）
+        if col_prefix == 'rate_up':
+            # 向上压力：ultimate_rate 乘上 (1 + 对应期限的向上压力参数)
+            adjusted_ultimate_rate = ultimate_rate * (1 + up_param_map.get(40, 0))
+        elif col_prefix == 'rate_down':
+            # 向下压力：ultimate_rate 乘上 (1 + 对应期限的向下压力参数)
+            adjusted_ultimate_rate = ultimate_rate * (1 + down_param_map.get(40, 0))
+        else:
+            # 基础情况：使用原始 ultimate_rate
+            adjusted_ultimate_rate = ultimate_rate
+        
+        # 第一次插值（rate_1）
+        rate_curve_df[rate_1_col] = None
+        rate_20 = rate_curve_df[rate_curve_df['date'] == 20][base_col].values[0]
+        
+        for i, row in rate_curve_df.iterrows():
+            term = row['date']
+            rate = row[base_col]
+            
+            if term <= 20:
+                rate_1 = rate
+            elif 20 < term < 41:
+                rate_1 = rate_20 + (adjusted_ultimate_rate - rate_20) * (term - 20) / 20
+            else:
+                rate_1 = adjusted_ultimate_rate
+            
+            rate_curve_df.loc[i, rate_1_col] = rate_1
+        
+        # 第二次插值（rate_2）
+        rate_curve_df[rate_2_col] = None
+        
+        for i, row in rate_curve_df.iterrows():
+            term = row['date']
+            rate = row[base_col]
+            rate_1 = row[rate_1_col]
+            
+            if term < 20 or term >= 41:
+                rate_2 = rate_1
+            else:
+                rate_2 = rate_1 * (term - 20) / 20 + rate * (40 - term) / 20
+            
+            rate_curve_df.loc[i, rate_2_col] = rate_2
+        
+        # 溢价调整（rate_3）
+        rate_curve_df[rate_3_col] = None
+        
+        for i, row in rate_curve_df.iterrows():
+            term = row['date']
+            rate_2 = row[rate_2_col]
+            
+            if term <= 20:
+                rate_3 = rate_2 + premium_base_1
+            elif term >= 41:
+                rate_3 = rate_2 + premium_base_2
+            else:
+                rate_3 = rate_2 + (premium_base_1-premium_base_2) * (40 - term) / 20
+            
+            rate_curve_df.loc[i, rate_3_col] = rate_3
+        
+        # 转远期计算（rate_4）
+        rate_curve_df[rate_4_col] = None
+        
+        # 第一年：rate_4等于rate_3
+        first_row = rate_curve_df.iloc[0]
+        rate_curve_df.loc[first_row.name, rate_4_col] = round(first_row[rate_3_col], 2)
+        
+        # 后续年份：根据公式计算远期利率
+        for i in range(1, len(rate_curve_df)):
+            current_row = rate_curve_df.iloc[i]
+            prev_row = rate_curve_df.iloc[i-1]
+            
+            current_date = current_row['date']
+            prev_date = prev_row['date']
+            current_rate3 = current_row[rate_3_col]
+            prev_rate3 = prev_row[rate_3_col]
+            
+            # 计算公式：((1+current_rate3/100)^current_date / (1+prev_rate3/100)^prev_date - 1) * 100
+            forward_rate = (((1 + current_rate3 / 100) ** current_date) / 
+                            ((1 + prev_rate3 / 100) ** prev_date) - 1) * 100
+            
+            # 保留两位小数
+            rate_curve_df.loc[current_row.name, rate_4_col] = round(forward_rate, 2)
+    
+    return rate_curve_df
+
+def annual_to_monthly(rate_curve_df, rate_cols=['rate_4', 'rate_up_4', 'rate_down_4'], max_years=50):
+    """
+    将年度利率曲线转换为月度利率曲线，并计算对应的折现率
+    
+    参数:
+    - rate_curve_df: 包含年度利率列的DataFrame
+    - rate_cols: 需要转换的年度利率列名列表
+    - max_years: 最大转换年数（默认50年=600个月）
+    
+    返回:
+    - 包含月度利率和折现率的DataFrame
+    """
+    # 创建月度期限列表
+    total_months = max_years * 12
+    months = list(range(1, total_months + 1))
+    monthly_df = pd.DataFrame({'month': months})
+    
+    # 从年度曲线中提取年份信息
+    rate_curve_df['year'] = rate_curve_df['date'].astype(int)
+
+    #排序输出列
+    result_columns = ['month']
+    monthly_rate_columns = []
+    discount_factor_columns = []
+    
+    # 对每个需要转换的利率列进行处理
+    for rate_col in rate_cols:
+        # 创建对应的月度利率列名和折现率列名
+        monthly_rate_col = rate_col.replace('_4', '_monthly')
+        discount_factor_col = rate_col.replace('_4', '_discount')
+        
+        # 添加到结果列组
+        monthly_rate_columns.append(monthly_rate_col)
+        discount_factor_columns.append(discount_factor_col)
+
+        # 初始化月度利率列和折现率列
+        monthly_df[monthly_rate_col] = None
+        monthly_df[discount_factor_col] = None
+        
+        # 累积折现因子（初始值为1）
+        cumulative_discount = 1.0
+        
+        # 对每个月进行处理
+        for _, row in monthly_df.iterrows():
+            month = row['month']
+            year = (month - 1) // 12 + 1  # 计算对应的年份
+            
+            # 查找该年的年度利率
+            year_row = rate_curve_df[rate_curve_df['year'] == year]
+            
+            if not year_row.empty:
+                annual_rate = year_row[rate_col].values[0]
+                
+                # 月度利率计算公式: (1 + 年利率/100)^(1/12) - 1
+                monthly_rate = ((1 + annual_rate / 100) ** (1/12) - 1) 
+                monthly_df.loc[monthly_df['month'] == month, monthly_rate_col] = monthly_rate
+            
+                # 计算当月折现因子: 1 / (1 + 月利率/100)
+                monthly_discount = 1 / (1 + monthly_rate)
+                
+                # 累积折现因子: 累乘每个月的折现因子
+                cumulative_discount *= monthly_discount
+                monthly_df.loc[monthly_df['month'] == month, discount_factor_col] = cumulative_discount
+
+    result_columns += monthly_rate_columns + discount_factor_columns
+    
+    return monthly_df[result_columns]
+
+
+def discount_cashflows(result_df, monthly_df, cashflow_start_col=5):
+    """
+    使用矩阵运算对按列存储的现金流进行折现,三条曲线得到pv,pv_down,pv_up
+    
+    参数:
+    1.result_df: cashflow_cal返回资产现金流表，默认601个月
+    2.monthly_df: 月度折现率表（包含600个月的折现因子）
+    3.cashflow_start_col: 现金流起始列索引，需要根据cashflow_cal中metadata字典配置数量（账户，代码，名称等）设置
+    4.output_file：main中写入excel文件的路径
+    
+    返回:
+    1.result:包含三个情景折现值的DataFramepv,包含pv,pv_down,pv_up
+    """
+    
+    # 提取现金流列（从cashflow_start_col开始到最后一列）
+    cashflow_cols = result_df.columns[cashflow_start_col:]
+    
+    # 确保现金流列数量为601（month=1~601）
+    if len(cashflow_cols) != 601:
+        raise ValueError(f"现金流列数量应为601，但实际为{len(cashflow_cols)}")
+    
+    # 提取后600个月的现金流列（month=2~601）
+    cashflow_cols = cashflow_cols[1:]  # 跳过第1个月
+    
+    # 提取三个情景的折现因子（month=1~600）
+    discount_factors = monthly_df[[
+        'rate_discount',
+        'rate_down_discount',
+        'rate_up_discount'
+    ]].values
+    
+    # 将现金流数据转换为NumPy数组（形状：[资产数, 600个月]）
+    cashflow_matrix = result_df[cashflow_cols].values
+    
+    # 矩阵乘法计算折现值（每个资产在每个情景下的总折现值）
+    discounted_matrix = cashflow_matrix @ discount_factors
+    
+    # 创建结果DataFrame
+    result = pd.DataFrame({
+        'account_1': result_df.iloc[:, 0],
+        'account_2': result_df.iloc[:, 1],
+        'product_type': result_df.iloc[:, 2],
+        'bond_code': result_df.iloc[:, 3],
+        'bond_name': result_df.iloc[:, 4],
+        'pv': discounted_matrix[:, 0],
+        'pv_down': discounted_matrix[:, 1],
+        'pv_up': discounted_matrix[:, 2]
+    })
+    
+    return result
@@ -0,0 +1,204 @@
+import os
+import sys
+import json
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from tools import read_config, config_hash
+
+"""
+估值结果库：把每次discount_cashflows的结果连同运行信息追加写入按评估日分区的parquet数据集，
+跨季度对比pv时直接按评估日、bond_code或账户查询，不再打开各期的<start_date>mc.xlsx
+目录结构：
+store_dir/
+    results/valuation_date=YYYYMMDD/<run_id>.parquet   每次运行一个文件，按bond_code,account_1,account_2排序
+    runs/<run_id>.parquet                              运行信息（一行）：配置哈希、债券文件、曲线文件、曲线参数等
+说明：
+1.只追加不改写：同一评估日重复计算会新增run，查询默认只取每个评估日最新的run
+2.评估日是分区字段，查询时先由运行信息确定要读的文件；文件内按bond_code排序并按较小的行组写入，
+  bond_code条件借助行组统计信息跳过无关数据；文件只写不改，文件尾元数据在进程内缓存，
+  单券多年序列查询为毫秒级
+3.import_excel_results可把历史<start_date>mc.xlsx批量补录进结果库
+"""
+
+ROW_GROUP_SIZE = 1024
+VALUE_COLS = ['pv', 'pv_down', 'pv_up']
+METRIC_COLS = ['macaulay_duration', 'modified_duration', 'convexity', 'wal']
+KEY_COLS = ['account_1', 'account_2', 'product_type', 'bond_code', 'bond_name']
+RUN_COLS = ['run_id', 'valuation_date', 'created_at', 'config_hash', 'file_path', 'curve_path',
+            'stress_data', 'curve_params', 'bonds', 'note']
+PARQUET_CACHE = {}
+RUN_CACHE = {}
+
+def write_parquet_atomic(table, path):
+    """先写临时文件再重命名，避免中断时留下半个文件"""
+    tmp_path = path + '.tmp'
+    pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+
+def append_run(store_dir, result, config, curve_params=None, note=''):
+    """
+    追加一次运行结果
+
+    参数:
+    1.store_dir: 结果库目录
+    2.result: discount_cashflows返回的DataFrame（可带久期等附加指标列）
+    3.config: read_config读取的配置字典，评估日取start_date
+    4.curve_params: 曲线参数，如{'ultimate_rate': 4.5, 'premium_base_1': 0.45, 'premium_base_2': 0}
+    5.note: 备注
+
+    返回:
+    1.run_id
+    """
+    valuation_date = str(config.get("start_date"))
+    created_at = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    hash_value = config_hash(config)
+    run_id = f"{valuation_date}_{created_at}_{hash_value[:8]}"
+
+    # 固定列结构，未计算风险指标时对应列为空值，保证各次运行的schema一致
+    results = pd.DataFrame({col: result[col].astype(str) for col in KEY_COLS})
+    for col in VALUE_COLS + METRIC_COLS:
+        results[col] = result[col].to_numpy(dtype=float) if col in result.columns else np.nan
+    results = results.sort_values(['bond_code', 'account_1', 'account_2'], kind='stable').reset_index(drop=True)
+    results.insert(0, 'run_id', run_id)
+
+    partition_dir = os.path.join(store_dir, 'results', f'valuation_date={valuation_date}')
+    runs_dir = os.path.join(store_dir, 'runs')
+    os.makedirs(partition_dir, exist_ok=True)
+    os.makedirs(runs_dir, exist_ok=True)
+    write_parquet_atomic(pa.Table.from_pandas(results, preserve_index=False),
+                         os.path.join(partition_dir, f'{run_id}.parquet'))
+
+    run_info = pd.DataFrame([{
+        'run_id': run_id,
+        'valuation_date': valuation_date,
+        'created_at': created_at,
+        'config_hash': hash_value,
+        'file_path': str(config.get("file_path")),
+        'curve_path': str(config.get("curve_path")),
+        'stress_data': json.dumps(config.get("stress_data"), ensure_ascii=False),
+        'curve_params': json.dumps(curve_params or {}, ensure_ascii=False),
+        'bonds': len(results),
+        'note': note,
+    }])
+    write_parquet_atomic(pa.Table.from_pandas(run_info, preserve_index=False),
+                         os.path.join(runs_dir, f'{run_id}.parquet'))
+    print(f"已写入结果库: {run_id}，共 {len(results)} 条")
+    return run_id
+
+def open_parquet(path):
+    """打开parquet文件并缓存文件尾元数据（结果库文件写入后不再修改，缓存无需失效）"""
+    parquet_file = PARQUET_CACHE.get(path)
+    if parquet_file is None:
+        parquet_file = pq.ParquetFile(path)
+        PARQUET_CACHE[path] = parquet_file
+    return parquet_file
+
+def run_records(store_dir):
+    """读取全部运行信息（每个运行文件只读一次并缓存），按评估日、写入时间排序"""
+    runs_dir = os.path.join(store_dir, 'runs')
+    if not os.path.isdir(runs_dir):
+        return []
+    records = []
+    for name in os.listdir(runs_dir):
+        if not name.endswith('.parquet'):
+            continue
+        path = os.path.join(runs_dir, name)
+        if path not in RUN_CACHE:
+            RUN_CACHE[path] = pq.read_table(path).to_pylist()[0]
+        records.append(RUN_CACHE[path])
+    return sorted(records, key=lambda record: (record['valuation_date'], record['created_at']))
+
+def list_runs(store_dir):
+    """返回全部运行信息DataFrame"""
+    return pd.DataFrame(run_records(store_dir), columns=RUN_COLS)
+
+def select_runs(store_dir, start_date=None, end_date=None, latest_only=True):
+    """按评估日区间筛选运行，latest_only时每个评估日只保留最新一次"""
+    records = [record for record in run_records(store_dir)
+               if (start_date is None or record['valuation_date'] >= str(start_date))
+               and (end_date is None or record['valuation_date'] <= str(end_date))]
+    if latest_only:
+        # 已按写入时间排序，同一评估日后写入的覆盖先写入的
+        records = list({record['valuation_date']: record for record in records}.values())
+    return records
+
+def query_results(store_dir, start_date=None, end_date=None, columns=None, latest_only=True, **filters):
+    """
+    按评估日区间和字段条件查询结果
+
+    参数:
+    1.store_dir: 结果库目录
+    2.start_date, end_date: 评估日区间（YYYYMMDD，含端点），None表示不限
+    3.columns: 返回的指标列，默认pv,pv_down,pv_up
+    4.latest_only: 每个评估日只取最新一次运行
+    5.filters: 字段条件，如bond_code='xxx'，account_1=['传统险','分红险']
+
+    返回:
+    1.DataFrame：valuation_date + 元数据 + 指标列，按评估日排序
+    """
+    columns = VALUE_COLS if columns is None else list(columns)
+    filters = {col: [str(v) for v in value] if isinstance(value, (list, tuple, set)) else [str(value)]
+               for col, value in filters.items()}
+    unknown = [col for col in filters if col not in KEY_COLS]
+    if unknown:
+        raise ValueError(f"不支持的筛选字段: {', '.join(unknown)}")
+
+    tables = []
+    for run in select_runs(store_dir, start_date, end_date, latest_only):
+        path = os.path.join(store_dir, 'results', f"valuation_date={run['valuation_date']}", f"{run['run_id']}.parquet")
+        parquet_file = open_parquet(path)
+        row_groups = list(range(parquet_file.num_row_groups))
+        if 'bond_code' in filters:
+            # 文件按bond_code排序，用行组的最小/最大值跳过不含目标代码的行组
+            col_idx = parquet_file.schema_arrow.get_field_index('bond_code')
+            codes = filters['bond_code']
+            row_groups = [i for i in row_groups
+                          if any(parquet_file.metadata.row_group(i).column(col_idx).statistics.min <= code
+                                 <= parquet_file.metadata.row_group(i).column(col_idx).statistics.max
+                                 for code in codes)]
+        if not row_groups:
+            continue
+        table = parquet_file.read_row_groups(row_groups, columns=['run_id'] + KEY_COLS + columns)
+        for col, values in filters.items():
+            table = table.filter(pc.is_in(table[col], value_set=pa.array(values)))
+        tables.append(table.add_column(0, 'valuation_date', pa.array([run['valuation_date']] * table.num_rows, pa.string())))
+
+    if not tables:
+        return pd.DataFrame(columns=['valuation_date', 'run_id'] + KEY_COLS + columns)
+    results = pa.concat_tables(tables).sort_by([('valuation_date', 'ascending'), ('account_1', 'ascending'),
+                                                ('account_2', 'ascending'), ('bond_code', 'ascending')])
+    return results.to_pandas()
+
+def query_bond_history(store_dir, bond_code, start_date=None, end_date=None, columns=None):
+    """单券各评估日结果序列"""
+    return query_results(store_dir, start_date, end_date, columns, bond_code=bond_code)
+
+def query_account_history(store_dir, group_cols=('account_1',), start_date=None, end_date=None, columns=None, **filters):
+    """按账户等字段汇总的各评估日序列"""
+    columns = VALUE_COLS if columns is None else list(columns)
+    results = query_results(store_dir, start_date, end_date, columns, **filters)
+    return results.groupby(['valuation_date'] + list(group_cols))[columns].sum().reset_index()
+
+def import_excel_results(store_dir, excel_path, config, note='从Excel补录'):
+    """把历史<start_date>mc.xlsx补录进结果库（config中start_date应为该文件的评估日）"""
+    result = pd.read_excel(excel_path, index_col=0)
+    missing_cols = [col for col in KEY_COLS + VALUE_COLS if col not in result.columns]
+    if missing_cols:
+        raise ValueError(f"结果文件缺少必要的列: {', '.join(missing_cols)}")
+    return append_run(store_dir, result, config, note=note)
+
+
+if __name__ == "__main__":
+    config_path = input("参数配置文件:").strip()
+    config = read_config(config_path)
+    if not config:
+        sys.exit(1)
+    store_dir = input("结果库目录 (默认results_store):").strip() or "results_store"
+    excel_path = input("待补录的结果文件 (默认<start_date>mc.xlsx):").strip() or config.get("start_date") + 'mc.xlsx'
+    import_excel_results(store_dir, excel_path, config)
+    runs = list_runs(store_dir)
+    print(f"结果库共 {len(runs)} 次运行，评估日: {', '.join(sorted(runs['valuation_date'].unique()))}")
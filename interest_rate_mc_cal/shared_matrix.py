@@ -0,0 +1,265 @@
+import os
+import sys
+import uuid
+import atexit
+import tempfile
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import ProcessPoolExecutor
+from cashflow_cal import generate_cashflows
+from interest_curve_cal import build_monthly_df
+from tools import read_config
+
+"""
+多进程折现的共享矩阵层：折现因子矩阵和现金流矩阵只在主进程写入一次共享内存（或内存映射文件），
+子进程按名称挂载为NumPy视图，不复制、不经过pickle，向进程池分发任务的开销与数据量无关
+1.SharedMatrix：可pickle的轻量句柄，只记录名称/路径、形状和dtype，子进程调用attach得到视图
+2.SharedMatrixPool：主进程中共享矩阵的所有者，put写入，close（或with语句结束、进程退出时）统一释放
+  backend='shm'使用multiprocessing.shared_memory；backend='memmap'在directory下创建内存映射文件，
+  适用于/dev/shm空间不足或需要跨多次运行保留的情况
+3.parallel_discount：按行区间把现金流矩阵分给进程池，各子进程直接把结果写入共享的输出矩阵
+4.parallel_discount_cashflows：对cashflow_cal的result_df并行折现，结果与mc_cal.discount_cashflows相同
+"""
+
+ATTACHED = {}
+MAX_ATTACHED = 32
+
+class SharedMatrix:
+    """共享矩阵句柄，只包含挂载所需的元信息，可作为任务参数传给子进程"""
+
+    def __init__(self, name, shape, dtype, backend='shm', path=None):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).str
+        self.backend = backend
+        self.path = path
+
+    def __repr__(self):
+        return f"SharedMatrix({self.name}, shape={self.shape}, dtype={self.dtype}, backend={self.backend})"
+
+    def attach(self):
+        """
+        挂载为NumPy视图（不复制数据），同一进程内重复挂载返回缓存的视图
+        进程池子进程与主进程共用同一个资源跟踪进程，共享内存的删除只由SharedMatrixPool.close负责；
+        子进程任务结束前须调用detach，否则已删除的共享内存仍被映射，直到子进程退出才回收
+        """
+        view = ATTACHED.get(self.name)
+        if view is not None:
+            return view[1]
+        if self.backend == 'memmap':
+            block = None
+            array = np.memmap(self.path, dtype=self.dtype, mode='r+', shape=self.shape)
+        else:
+            block = shared_memory.SharedMemory(name=self.name)
+            array = np.ndarray(self.shape, dtype=self.dtype, buffer=block.buf)
+        # 长期运行的子进程只保留最近挂载的若干个矩阵，主进程已删除的共享内存随之回收
+        while len(ATTACHED) >= MAX_ATTACHED:
+            detach(next(iter(ATTACHED)))
+        ATTACHED[self.name] = (block, array)
+        return array
+
+def detach(name):
+    """释放当前进程中某个共享矩阵的视图（不删除共享数据），未挂载时不做处理"""
+    if name not in ATTACHED:
+        return
+    block, array = ATTACHED.pop(name)
+    del array
+    if block is not None:
+        try:
+            block.close()
+        except BufferError:
+            pass
+
+def detach_all():
+    """释放当前进程挂载的全部视图"""
+    for name in list(ATTACHED):
+        detach(name)
+
+
+class SharedMatrixPool:
+    """
+    共享矩阵的所有者（只在主进程中创建）
+
+    参数:
+    1.backend: 'shm'（共享内存）或'memmap'（内存映射文件）
+    2.directory: memmap文件目录，默认系统临时目录
+    """
+
+    def __init__(self, backend='shm', directory=None):
+        if backend not in ('shm', 'memmap'):
+            raise ValueError("backend应为'shm'或'memmap'")
+        self.backend = backend
+        self.directory = directory or tempfile.gettempdir()
+        self.blocks = {}
+        self.prefix = f"mc_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        atexit.register(self.close)
+
+    def allocate(self, key, shape, dtype=np.float64):
+        """分配未初始化的共享矩阵，返回(句柄, 主进程视图)"""
+        if key in self.blocks:
+            raise ValueError(f"共享矩阵已存在: {key}")
+        dtype = np.dtype(dtype)
+        name = f"{self.prefix}_{key}"
+        nbytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        if self.backend == 'memmap':
+            path = os.path.join(self.directory, name + '.dat')
+            array = np.memmap(path, dtype=dtype, mode='w+', shape=tuple(shape))
+            handle = SharedMatrix(name, shape, dtype, 'memmap', path)
+            self.blocks[key] = (handle, None, array)
+        else:
+            block = shared_memory.SharedMemory(name=name, create=True, size=nbytes)
+            array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            handle = SharedMatrix(name, shape, dtype, 'shm')
+            self.blocks[key] = (handle, block, array)
+        return handle, array
+
+    def put(self, key, array, dtype=None):
+        """把数组复制进共享矩阵（只复制这一次），返回句柄"""
+        array = np.asarray(array, dtype=dtype)
+        handle, view = self.allocate(key, array.shape, array.dtype)
+        view[...] = array
+        return handle
+
+    def get(self, key):
+        """主进程中的视图"""
+        return self.blocks[key][2]
+
+    def handle(self, key):
+        return self.blocks[key][0]
+
+    def nbytes(self):
+        return sum(item[2].nbytes for item in self.blocks.values())
+
+    def release(self, *keys):
+        """释放并删除指定的共享矩阵"""
+        entries = [self.blocks.pop(key) for key in keys if key in self.blocks]
+        items = [(handle, block) for handle, block, _ in entries]
+        # 先释放主进程持有的视图，才能关闭映射、删除文件
+        del entries
+        for handle, block in items:
+            ATTACHED.pop(handle.name, None)
+            if block is not None:
+                block.unlink()
+                try:
+                    block.close()
+                except BufferError:
+                    # 外部仍持有视图时暂不关闭映射，名称已删除，最后一个视图释放后内存即回收
+                    pass
+            elif os.path.exists(handle.path):
+                try:
+                    os.remove(handle.path)
+                except PermissionError:
+                    # Windows下文件仍被映射时无法删除
+                    print(f"⚠️ 内存映射文件仍在使用，未能删除: {handle.path}")
+
+    def close(self):
+        """释放并删除全部共享矩阵，可重复调用"""
+        self.release(*list(self.blocks))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def discount_rows(cashflow_handle, discount_handle, output_handle, start, end, skip_first_col):
+    """子进程任务：对[start, end)行折现并写入共享输出矩阵，只返回行数"""
+    try:
+        return discount_block(cashflow_handle, discount_handle, output_handle, start, end, skip_first_col)
+    finally:
+        # 任务结束即释放视图，主进程release后共享内存/映射文件可立即回收，不会在长期运行的子进程中累积
+        for handle in (cashflow_handle, discount_handle, output_handle):
+            detach(handle.name)
+
+def discount_block(cashflow_handle, discount_handle, output_handle, start, end, skip_first_col):
+    cashflow_matrix = cashflow_handle.attach()
+    discount_factors = discount_handle.attach()
+    output = output_handle.attach()
+    block = cashflow_matrix[start:end, 1:] if skip_first_col else cashflow_matrix[start:end]
+    # float32紧凑现金流按块转为float64再相乘，与mc_cal.discount_compact一致
+    output[start:end] = block.astype(np.float64, copy=False) @ discount_factors
+    return end - start
+
+def parallel_discount(cashflow_matrix, discount_factors, workers=4, chunk_rows=4096, pool=None, executor=None):
+    """
+    多进程矩阵折现
+
+    参数:
+    1.cashflow_matrix: [债券数, 601]（第0列为评估月，不参与折现）或[债券数, 600]的现金流矩阵，
+      也可以是已放入共享内存的SharedMatrix句柄
+    2.discount_factors: [600, 情景数]折现因子矩阵或SharedMatrix句柄，多情景时各列为一个情景
+    3.workers: 进程数
+    4.chunk_rows: 每个任务的行数
+    5.pool: SharedMatrixPool，不传时临时创建并在结束后释放
+    6.executor: 已有的ProcessPoolExecutor，不传时临时创建；复用时应在pool中放入长期使用的矩阵之前创建，
+      否则（fork方式）子进程会继承这些映射，直到进程池关闭才释放
+
+    返回:
+    1.discounted: [债券数, 情景数]
+    """
+    own_pool = pool is None
+    pool = pool or SharedMatrixPool()
+    own_executor = executor is None
+    executor = executor or ProcessPoolExecutor(max_workers=workers)
+    key = uuid.uuid4().hex[:8]
+    temp_keys = [f'cf_{key}', f'df_{key}', f'out_{key}']
+    # 进程池按需启动子进程，先启动再写入共享矩阵，避免fork出的子进程继承本次调用的映射、在进程池存续期间占用内存；
+    # 资源跟踪进程（仅POSIX系统使用）须在子进程启动前运行，子进程才会与主进程共用；Windows共享内存不经过资源跟踪进程
+    if os.name == 'posix':
+        resource_tracker.ensure_running()
+    executor.submit(int).result()
+    try:
+        cashflow_handle = cashflow_matrix if isinstance(cashflow_matrix, SharedMatrix) else pool.put(f'cf_{key}', cashflow_matrix)
+        discount_handle = discount_factors if isinstance(discount_factors, SharedMatrix) else pool.put(f'df_{key}', discount_factors, dtype=np.float64)
+        num_bonds, num_cols = cashflow_handle.shape
+        months, num_scenarios = discount_handle.shape
+        if num_cols not in (months, months + 1):
+            raise ValueError(f"现金流列数量应为{months}或{months + 1}，但实际为{num_cols}")
+        output_handle, output = pool.allocate(f'out_{key}', (num_bonds, num_scenarios))
+
+        # 任务参数只有句柄和行号，与数据量无关
+        futures = [executor.submit(discount_rows, cashflow_handle, discount_handle, output_handle,
+                                   start, min(start + chunk_rows, num_bonds), num_cols == months + 1)
+                   for start in range(0, num_bonds, chunk_rows)]
+        for future in futures:
+            future.result()
+        return np.array(output)
+    finally:
+        if own_executor:
+            executor.shutdown()
+        if own_pool:
+            pool.close()
+        else:
+            # 使用外部pool时只释放本次调用临时放入的矩阵，调用方传入的句柄保持不变
+            pool.release(*temp_keys)
+
+def parallel_discount_cashflows(result_df, monthly_df, cashflow_start_col=5, workers=4, chunk_rows=4096, pool=None, executor=None):
+    """
+    对cashflow_cal返回的result_df并行折现，返回格式与mc_cal.discount_cashflows相同（pv,pv_down,pv_up）
+    """
+    cashflow_matrix = result_df.iloc[:, cashflow_start_col:].to_numpy(dtype=float)
+    if cashflow_matrix.shape[1] != 601:
+        raise ValueError(f"现金流列数量应为601，但实际为{cashflow_matrix.shape[1]}")
+    discount_factors = monthly_df[['rate_discount', 'rate_down_discount', 'rate_up_discount']].to_numpy(dtype=float)
+    discounted = parallel_discount(cashflow_matrix, discount_factors, workers, chunk_rows, pool, executor)
+
+    result = result_df.iloc[:, :cashflow_start_col].copy()
+    result['pv'] = discounted[:, 0]
+    result['pv_down'] = discounted[:, 1]
+    result['pv_up'] = discounted[:, 2]
+    return result
+
+
+if __name__ == "__main__":
+    config_path = input("参数配置文件:").strip()
+    config = read_config(config_path)
+    if not config:
+        sys.exit(1)
+    workers = input("进程数 (默认4):").strip()
+    workers = int(workers) if workers else 4
+
+    result_df, principal_result_df, coupon_result_df = generate_cashflows(config.get("file_path"), config.get("start_date"), months=601)
+    monthly_df = build_monthly_df(config.get("curve_path"), config.get("stress_data"))
+    result = parallel_discount_cashflows(result_df, monthly_df, workers=workers)
+    print(f"并行折现完成: {len(result)} 只债券，pv合计 {result['pv'].sum():,.2f}")
@@ -13,7 +13,10 @@ tools包含各类辅助工具包，包括：
     }
 }
 
-2.beautify_excel：
+2.config_hash:
+配置内容的哈希值（键排序后的json做sha256，取前16位），用于标识一次计算所用的参数，配置内容不变则哈希不变
+
+3.beautify_excel：
 美化Excel文件的函数，主要用于美化mc_cal后返回的mc.xlsx
 目前功能：标题行、文本列居中，数据列右对齐，加边框，数据加千分位分割，自动调整列宽
 """
@@ -24,6 +27,7 @@ from openpyxl.styles import Font, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
 import numpy as np
 import json
+import hashlib
 
 #读取配置
 def read_config(file_path="myconfig.json"):
@@ -39,6 +43,11 @@ def read_config(file_path="myconfig.json"):
         print(f"错误：配置文件 {file_path} 格式不正确")
         return None
 
+def config_hash(config):
+    """返回配置字典的哈希值"""
+    content = json.dumps(config, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+
 def beautify_excel(input_file, output_file, header=True, thousands_sep=True, auto_fit=True):
     """
     标题行、文本列居中，数据列右对齐，加边框，数据加千分位分割，自动调整列宽
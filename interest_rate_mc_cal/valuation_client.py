@@ -0,0 +1,128 @@
+import json
+import time
+import threading
+import numpy as np
+import http.client
+from urllib.parse import urlencode
+
+"""
+valuation_service的本地客户端和压测脚本
+1.ValuationClient：保持一个HTTP长连接，bond/portfolio/scenarios/curve/reload对应服务端接口
+2.load_test：多线程压测，每个线程独立连接，统计吞吐量和延迟分位数
+直接运行本文件进行压测（需先启动valuation_service）
+"""
+
+class ValuationClient:
+    """估值服务客户端，复用同一个长连接"""
+
+    def __init__(self, host='127.0.0.1', port=8765, timeout=30):
+        self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def request(self, path, params=None, method='GET'):
+        """发送请求并返回解析后的json，服务端返回错误时抛出RuntimeError"""
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        self.connection.request(method, path, headers={'Content-Length': '0'} if method == 'POST' else {})
+        response = self.connection.getresponse()
+        payload = json.loads(response.read().decode('utf-8'))
+        if response.status != 200:
+            raise RuntimeError(f"{response.status}: {payload.get('error')}")
+        return payload
+
+    def health(self):
+        return self.request('/health')
+
+    def bond(self, bond_code, scenario=None):
+        params = {'bond_code': bond_code}
+        if scenario:
+            params['scenario'] = scenario
+        return self.request('/bond', params)
+
+    def portfolio(self, **filters):
+        return self.request('/portfolio', filters)
+
+    def scenarios(self, group_by=None):
+        return self.request('/scenarios', {'group_by': ','.join(group_by)} if group_by else None)
+
+    def curve(self, month):
+        return self.request('/curve', {'month': month})
+
+    def reload(self):
+        return self.request('/reload', method='POST')
+
+    def close(self):
+        self.connection.close()
+
+def load_test(requests, host='127.0.0.1', port=8765, total=2000, threads=4):
+    """
+    多线程压测
+
+    参数:
+    1.requests: 请求列表，每项为(path, params)，按顺序循环发送
+    2.total: 总请求数
+    3.threads: 并发线程数
+
+    返回:
+    1.stats: 字典，包含请求数、错误数、吞吐量(次/秒)及p50/p95/p99/max延迟(毫秒)
+    """
+    latencies = [[] for _ in range(threads)]
+    errors = [0] * threads
+
+    def worker(k):
+        client = ValuationClient(host, port)
+        try:
+            for i in range(k, total, threads):
+                path, params = requests[i % len(requests)]
+                start = time.perf_counter()
+                try:
+                    client.request(path, params)
+                except Exception:
+                    errors[k] += 1
+                latencies[k].append(time.perf_counter() - start)
+        finally:
+            client.close()
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(k,)) for k in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    all_latencies = np.concatenate([np.asarray(item) for item in latencies]) * 1000
+    p50, p95, p99 = np.percentile(all_latencies, [50, 95, 99])
+    return {
+        'requests': len(all_latencies),
+        'errors': sum(errors),
+        'throughput': len(all_latencies) / elapsed,
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'max_ms': float(all_latencies.max()),
+    }
+
+
+if __name__ == "__main__":
+    port = input("服务端口 (默认8765):").strip()
+    port = int(port) if port else 8765
+    total = input("总请求数 (默认2000):").strip()
+    total = int(total) if total else 2000
+
+    client = ValuationClient(port=port)
+    print(f"服务状态: {client.health()}")
+    # 从分组结果中取账户作为组合查询条件，从第一条单券查询结果中取bond_code
+    accounts = [row['account_1'] for row in client.scenarios(['account_1'])]
+    sample = client.scenarios(['bond_code'])[:50]
+    client.close()
+
+    requests = [('/bond', {'bond_code': row['bond_code']}) for row in sample]
+    requests += [('/portfolio', {'account_1': account}) for account in accounts]
+    requests += [('/curve', {'month': 120}), ('/scenarios', {'group_by': 'account_1,account_2'})]
+
+    stats = load_test(requests, port=port, total=total, threads=4)
+    print("===== 压测结果 =====")
+    print(f"请求数: {stats['requests']}，错误数: {stats['errors']}")
+    print(f"吞吐量: {stats['throughput']:.0f} 次/秒")
+    print(f"延迟(ms): p50={stats['p50_ms']:.2f} p95={stats['p95_ms']:.2f} "
+          f"p99={stats['p99_ms']:.2f} max={stats['max_ms']:.2f}")
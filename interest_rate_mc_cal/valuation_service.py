@@ -0,0 +1,292 @@
+import os
+import sys
+import json
+import time
+import threading
+import numpy as np
+import pandas as pd
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from cashflow_cal import generate_cashflows
+from interest_curve_cal import build_monthly_df
+from mc_cal import discount_cashflows
+from tools import read_config
+
+"""
+本地估值服务：启动时通过read_config读取一次配置，生成现金流、折现率曲线和pv结果并常驻内存，
+之后的临时查询（单券pv、组合pv、情景汇总）直接在内存中计算，不再重启Python、重读Excel。
+参数：
+1.config_path：与主流程相同的json配置文件
+2.host/port：监听地址，默认127.0.0.1:8765，仅供本机访问
+3.watch_interval：文件变更检查间隔（秒），配置文件、债券文件或曲线文件修改后自动重新加载，0表示不检查
+接口（均返回json）：
+GET  /health                              服务状态、评估日、债券数、加载时间
+GET  /bond?bond_code=X[&scenario=pv_up]   单券pv,pv_down,pv_up及久期等指标（同一代码多账户持仓时返回多行）
+GET  /portfolio?account_1=..&account_2=..&product_type=..   按条件筛选后的组合合计
+GET  /scenarios?group_by=account_1,account_2               按字段分组的三情景pv合计
+GET  /curve?month=12                      指定月份三条曲线的折现因子
+POST /reload                              强制重新加载
+客户端和压测脚本见valuation_client.py
+"""
+
+SCENARIO_COLS = ['pv', 'pv_down', 'pv_up']
+METRIC_COLS = ['macaulay_duration', 'modified_duration', 'convexity', 'wal']
+FILTER_COLS = ['account_1', 'account_2', 'product_type', 'bond_code']
+
+def load_valuation_snapshot(config_path):
+    """
+    按主流程生成一次完整的估值快照
+
+    返回:
+    1.snapshot: 字典，包含config、现金流矩阵、折现因子矩阵、pv结果及按bond_code的行索引
+    """
+    # 修改时间在读取前记录，加载期间保存的修改会在下一次检查时被发现
+    config_mtime = file_mtimes([config_path])
+    config = read_config(config_path)
+    if not config:
+        raise ValueError(f"配置文件读取失败: {config_path}")
+    file_path = config.get("file_path")
+    start_date = config.get("start_date")
+    curve_path = config.get("curve_path")
+    mtimes = config_mtime + file_mtimes([file_path, curve_path])
+
+    result_df, principal_result_df, coupon_result_df = generate_cashflows(file_path, start_date, months=601)
+    if result_df is None:
+        raise ValueError(f"现金流生成失败: {file_path}")
+    monthly_df = build_monthly_df(curve_path, config.get("stress_data"))
+    if monthly_df is None:
+        raise ValueError(f"折现率曲线生成失败: {curve_path}")
+
+    cashflow_start_col = len(result_df.columns) - 601
+    result = discount_cashflows(result_df, monthly_df, cashflow_start_col=cashflow_start_col,
+                                risk_metrics=True, principal_result_df=principal_result_df)
+
+    # 同一bond_code可能在多个账户持有，索引保存全部行号
+    bond_index = {}
+    for row, bond_code in enumerate(result['bond_code'].astype(str)):
+        bond_index.setdefault(bond_code, []).append(row)
+
+    return {
+        'config': config,
+        'config_path': config_path,
+        'watched_files': [config_path, file_path, curve_path],
+        'mtimes': mtimes,
+        'loaded_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'cashflow_matrix': result_df.iloc[:, cashflow_start_col + 1:].to_numpy(dtype=float),
+        'discount_factors': monthly_df[['rate_discount', 'rate_down_discount', 'rate_up_discount']].to_numpy(dtype=float),
+        'pv_matrix': result[SCENARIO_COLS].to_numpy(dtype=float),
+        'meta': result[['account_1', 'account_2', 'product_type', 'bond_code', 'bond_name']].astype(str),
+        'result': result,
+        'bond_index': bond_index,
+    }
+
+def file_mtimes(paths):
+    """返回文件修改时间列表，文件不存在时为None"""
+    return [os.path.getmtime(path) if path and os.path.exists(path) else None for path in paths]
+
+def json_safe(value):
+    """把NaN/inf（如pv为0时的久期等指标）及numpy数值转换为标准json可表示的值，NaN/inf输出为null"""
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+class ValuationState:
+    """常驻内存的估值状态，重新加载时先在后台生成新快照，再整体替换，查询不受影响"""
+
+    def __init__(self, config_path):
+        self.config_path = config_path
+        self.reload_lock = threading.Lock()
+        self.snapshot = load_valuation_snapshot(config_path)
+        # 自动重新加载失败时的文件修改时间，文件再次修改前不重复尝试
+        self.failed_mtimes = None
+
+    def reload(self):
+        """重新加载全部数据"""
+        with self.reload_lock:
+            snapshot = load_valuation_snapshot(self.config_path)
+            self.snapshot = snapshot
+        return snapshot['loaded_at']
+
+    def files_changed(self):
+        """配置、债券或曲线文件是否有修改（与上次加载失败时相同的不算）"""
+        snapshot = self.snapshot
+        mtimes = file_mtimes(snapshot['watched_files'])
+        return mtimes != snapshot['mtimes'] and mtimes != self.failed_mtimes
+
+    def reload_if_changed(self):
+        if self.files_changed():
+            print("检测到文件变更，正在重新加载...")
+            mtimes = file_mtimes(self.snapshot['watched_files'])
+            try:
+                self.reload()
+                self.failed_mtimes = None
+                print(f"重新加载完成: {self.snapshot['loaded_at']}")
+            except Exception as e:
+                self.failed_mtimes = mtimes
+                print(f"❌ 重新加载失败，继续使用原数据，文件再次修改后重试: {str(e)}")
+
+    def health(self):
+        snapshot = self.snapshot
+        return {
+            'status': 'ok',
+            'start_date': snapshot['config'].get('start_date'),
+            'bonds': len(snapshot['meta']),
+            'loaded_at': snapshot['loaded_at'],
+        }
+
+    def bond(self, bond_code, scenario=None):
+        """单券估值结果"""
+        snapshot = self.snapshot
+        rows = snapshot['bond_index'].get(bond_code)
+        if rows is None:
+            raise KeyError(f"未找到债券: {bond_code}")
+        cols = SCENARIO_COLS + METRIC_COLS if scenario is None else [check_scenario(scenario)]
+        records = snapshot['result'].iloc[rows][['account_1', 'account_2', 'product_type', 'bond_code', 'bond_name'] + cols]
+        return records.to_dict(orient='records')
+
+    def portfolio(self, filters):
+        """按账户/产品等条件筛选后的组合合计"""
+        snapshot = self.snapshot
+        mask = filter_mask(snapshot['meta'], filters)
+        totals = snapshot['pv_matrix'][mask].sum(axis=0)
+        response = {'bonds': int(mask.sum())}
+        response.update({col: float(value) for col, value in zip(SCENARIO_COLS, totals)})
+        return response
+
+    def scenarios(self, group_by):
+        """按字段分组的三情景合计"""
+        snapshot = self.snapshot
+        unknown = [col for col in group_by if col not in FILTER_COLS]
+        if unknown:
+            raise ValueError(f"不支持的分组字段: {', '.join(unknown)}")
+        pv_df = pd.DataFrame(snapshot['pv_matrix'], columns=SCENARIO_COLS)
+        if not group_by:
+            return [{col: float(pv_df[col].sum()) for col in SCENARIO_COLS}]
+        pv_df = pd.concat([snapshot['meta'][group_by], pv_df], axis=1)
+        return pv_df.groupby(group_by, sort=True).sum().reset_index().to_dict(orient='records')
+
+    def curve(self, month):
+        """指定月份（1~600）三条曲线的折现因子"""
+        discount_factors = self.snapshot['discount_factors']
+        if not 1 <= month <= len(discount_factors):
+            raise ValueError(f"月份应在1~{len(discount_factors)}之间")
+        return {'month': month, 'rate_discount': float(discount_factors[month - 1, 0]),
+                'rate_down_discount': float(discount_factors[month - 1, 1]),
+                'rate_up_discount': float(discount_factors[month - 1, 2])}
+
+def check_scenario(scenario):
+    if scenario not in SCENARIO_COLS:
+        raise ValueError(f"情景应为{', '.join(SCENARIO_COLS)}之一")
+    return scenario
+
+def filter_mask(meta, filters):
+    """根据查询条件生成行掩码，同一字段可用逗号分隔多个取值"""
+    mask = np.ones(len(meta), dtype=bool)
+    for col, value in filters.items():
+        if col not in FILTER_COLS:
+            raise ValueError(f"不支持的筛选字段: {col}")
+        mask &= meta[col].isin(value.split(',')).to_numpy()
+    return mask
+
+
+class ValuationHandler(BaseHTTPRequestHandler):
+    """HTTP请求处理，使用HTTP/1.1长连接并关闭Nagle算法，降低小请求的往返延迟"""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    state = None
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        try:
+            if parsed.path == '/health':
+                self.send_json(200, self.state.health())
+            elif parsed.path == '/bond':
+                if 'bond_code' not in params:
+                    raise ValueError("缺少参数bond_code")
+                self.send_json(200, self.state.bond(params['bond_code'], params.get('scenario')))
+            elif parsed.path == '/portfolio':
+                self.send_json(200, self.state.portfolio(params))
+            elif parsed.path == '/scenarios':
+                group_by = [col for col in params.get('group_by', '').split(',') if col]
+                self.send_json(200, self.state.scenarios(group_by))
+            elif parsed.path == '/curve':
+                self.send_json(200, self.state.curve(int(params.get('month', 1))))
+            else:
+                self.send_json(404, {'error': f"未知接口: {parsed.path}"})
+        except KeyError as e:
+            self.send_json(404, {'error': str(e.args[0])})
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+        except Exception as e:
+            self.send_json(500, {'error': f"查询失败: {str(e)}"})
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        # 读掉请求体，保持长连接可用
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            self.rfile.read(length)
+        if parsed.path == '/reload':
+            try:
+                self.send_json(200, {'status': 'reloaded', 'loaded_at': self.state.reload()})
+            except Exception as e:
+                self.send_json(500, {'error': f"重新加载失败: {str(e)}"})
+        else:
+            self.send_json(404, {'error': f"未知接口: {parsed.path}"})
+
+    def send_json(self, status, payload):
+        body = json.dumps(json_safe(payload), ensure_ascii=False, allow_nan=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 关闭逐请求日志，避免控制台输出拖慢响应
+        pass
+
+def watch_files(state, interval, stop_event):
+    """后台线程：定期检查文件变更并自动重新加载"""
+    while not stop_event.wait(interval):
+        state.reload_if_changed()
+
+def serve(config_path, host='127.0.0.1', port=8765, watch_interval=5):
+    """加载数据并启动服务（阻塞运行，Ctrl+C退出）"""
+    print("===== 正在加载估值数据 =====")
+    state = ValuationState(config_path)
+    print(f"已加载 {len(state.snapshot['meta'])} 只债券，评估日 {state.snapshot['config'].get('start_date')}")
+
+    handler = type('BoundValuationHandler', (ValuationHandler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+
+    stop_event = threading.Event()
+    if watch_interval:
+        threading.Thread(target=watch_files, args=(state, watch_interval, stop_event), daemon=True).start()
+
+    print(f"估值服务已启动: http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n估值服务已停止")
+    finally:
+        stop_event.set()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    config_path = input("参数配置文件:").strip()
+    if not config_path:
+        print("错误: 未提供配置文件")
+        sys.exit(1)
+    port = input("监听端口 (默认8765):").strip()
+    serve(config_path, port=int(port) if port else 8765)